@@ -0,0 +1,507 @@
+# ann_index.py
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from append_log import AppendLog, exclusive_lock
+from embedding_cache import normalize_text
+
+ANN_FORMAT_VERSION = 1
+
+# Rows scored per step when assigning vectors to lists, to bound memory
+ASSIGN_BLOCK_ROWS = 65536
+
+
+def ad_key(text):
+    """16-byte content hash of a normalized ad text; one index entry per distinct text."""
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).digest()
+
+
+def normalize_rows(X):
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / np.maximum(norms, 1e-12)
+
+
+def assign(X, centroids):
+    """Index of the most similar centroid for each (unit-norm) row of X."""
+    out = np.empty(len(X), dtype=np.int64)
+    for begin in range(0, len(X), ASSIGN_BLOCK_ROWS):
+        out[begin:begin + ASSIGN_BLOCK_ROWS] = np.argmax(X[begin:begin + ASSIGN_BLOCK_ROWS] @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(X, nlist, n_iter=15, max_train=None, seed=0):
+    """Spherical k-means over a sample of the rows of X (normalized as they are read)."""
+    rng = np.random.default_rng(seed)
+    max_train = max_train or 64 * nlist
+    sample = normalize_rows(X.take(np.sort(rng.choice(len(X), min(len(X), max_train), replace=False)), axis=0))
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = assign(sample, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=nlist)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        present = counts > 0
+        sums[present] = np.add.reduceat(sample[order], starts[present], axis=0)
+        empty = counts == 0
+        # Re-seed empty lists from random training points
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def default_nlist(n):
+    return int(np.clip(round(4 * np.sqrt(n)), 1, 65536))
+
+
+class _Rows:
+    """
+    Several arrays (e.g. a memory-mapped segment and the in-memory delta) read as
+    one, a block of rows at a time, so the whole never has to fit in memory.
+    `add` ({row: value}) is added to the rows it names as they are read.
+    """
+
+    def __init__(self, *parts, add=None):
+        self.parts = parts
+        self.starts = np.cumsum([0] + [len(part) for part in parts])
+        self.shape = (int(self.starts[-1]),) + parts[0].shape[1:]
+        self.dtype = parts[0].dtype
+        rows = sorted(add or {})
+        self._add_rows = np.asarray(rows, dtype=np.int64)
+        self._add_values = np.asarray([add[row] for row in rows], dtype=self.dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def take(self, indices, axis=0):
+        indices = np.asarray(indices, dtype=np.int64)
+        out = np.empty((len(indices),) + self.shape[1:], dtype=self.dtype)
+        part_of = np.searchsorted(self.starts, indices, side="right") - 1
+        for p, part in enumerate(self.parts):
+            mask = part_of == p
+            if mask.any():
+                out[mask] = part[indices[mask] - self.starts[p]]
+        if len(self._add_rows):
+            pos = np.minimum(np.searchsorted(self._add_rows, indices), len(self._add_rows) - 1)
+            hit = self._add_rows[pos] == indices
+            out[hit] += self._add_values[pos[hit]]
+        return out
+
+
+class _SegmentTexts:
+    """A segment's texts (memory-mapped texts.bin and offsets) followed by `extra` strings."""
+
+    def __init__(self, data, offsets, extra=()):
+        self.data = data
+        self.offsets = offsets
+        self.extra = extra
+
+    def take(self, indices):
+        n = len(self.offsets) - 1
+        return [bytes(self.data[self.offsets[i]:self.offsets[i + 1]]) if i < n else self.extra[i - n].encode("utf-8")
+                for i in indices]
+
+
+def write_segment(directory, vectors, keys, texts, clicks, impressions, nlist=None, centroids=None, labels=None):
+    """
+    Write an IVF segment: vectors grouped by inverted list so each probed list is
+    one contiguous slice of the memory-mapped matrix. Inputs (arrays, memmaps or
+    _Rows; texts as a list or _SegmentTexts) are read and written ASSIGN_BLOCK_ROWS
+    rows at a time, so memory stays bounded however large the segment. `labels`
+    (the list of each row) skips the assignment when `centroids` are reused.
+    """
+    os.makedirs(directory)
+    vectors = vectors if isinstance(vectors, (np.ndarray, _Rows)) else np.asarray(vectors, dtype=np.float32)
+    keys = keys if isinstance(keys, (np.ndarray, _Rows)) else np.asarray(keys, dtype="S16")
+    clicks = clicks if isinstance(clicks, (np.ndarray, _Rows)) else np.asarray(clicks, dtype=np.int64)
+    impressions = impressions if isinstance(impressions, (np.ndarray, _Rows)) else np.asarray(impressions, dtype=np.int64)
+    take_texts = texts.take if isinstance(texts, _SegmentTexts) else (lambda rows: [texts[i].encode("utf-8") for i in rows])
+    n = len(vectors)
+    if centroids is None:
+        nlist = min(nlist or default_nlist(n), n)
+        centroids = train_centroids(vectors, nlist)
+    if labels is None:
+        labels = np.empty(n, dtype=np.int64)
+        for begin in range(0, n, ASSIGN_BLOCK_ROWS):
+            block = np.arange(begin, min(begin + ASSIGN_BLOCK_ROWS, n))
+            labels[block] = assign(normalize_rows(vectors.take(block, axis=0)), centroids)
+    order = np.argsort(labels, kind="stable")
+    offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(labels, minlength=len(centroids)), out=offsets[1:])
+
+    def create(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(directory, name), mode="w+", dtype=dtype, shape=shape)
+
+    outputs = {
+        "vectors": create("vectors.npy", np.float32, (n, vectors.shape[1])),
+        "keys": create("keys.npy", "S16", (n,)),
+        "clicks": create("clicks.npy", np.int64, (n,)),
+        "impressions": create("impressions.npy", np.int64, (n,)),
+        "text_offsets": create("text_offsets.npy", np.int64, (n + 1,)),
+    }
+    outputs["text_offsets"][0] = 0
+    text_end = 0
+    with open(os.path.join(directory, "texts.bin"), "wb") as f:
+        for begin in range(0, n, ASSIGN_BLOCK_ROWS):
+            rows = order[begin:begin + ASSIGN_BLOCK_ROWS]
+            end = begin + len(rows)
+            outputs["vectors"][begin:end] = normalize_rows(vectors.take(rows, axis=0))
+            outputs["keys"][begin:end] = keys.take(rows, axis=0)
+            outputs["clicks"][begin:end] = clicks.take(rows, axis=0)
+            outputs["impressions"][begin:end] = impressions.take(rows, axis=0)
+            encoded = take_texts(rows)
+            lengths = np.fromiter((len(t) for t in encoded), dtype=np.int64, count=len(encoded))
+            outputs["text_offsets"][begin + 1:end + 1] = text_end + np.cumsum(lengths)
+            text_end += int(lengths.sum())
+            f.write(b"".join(encoded))
+    for out in outputs.values():
+        out.flush()
+    del outputs
+    np.save(os.path.join(directory, "centroids.npy"), centroids.astype(np.float32))
+    np.save(os.path.join(directory, "list_offsets.npy"), offsets)
+
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump({"version": ANN_FORMAT_VERSION, "dim": int(vectors.shape[1]),
+                   "rows": int(n), "nlist": int(len(centroids))}, f)
+
+
+def _publish(root, segment):
+    # CURRENT names the live segment; replacing it is the atomic switch
+    tmp = os.path.join(root, f"CURRENT.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "w") as f:
+        f.write(segment)
+    os.replace(tmp, os.path.join(root, "CURRENT"))
+
+
+def build_index(root, texts, vectors, clicks, impressions, nlist=None):
+    """Create (or replace) the index at `root` from one row per distinct ad."""
+    os.makedirs(root, exist_ok=True)
+    segment = f"segment-{time.time_ns()}"
+    keys = [ad_key(t) for t in texts]
+    write_segment(os.path.join(root, segment), vectors, keys, list(texts), clicks, impressions, nlist)
+    _publish(root, segment)
+    return segment
+
+
+def history_from_csv(path, text_column="Ad Topic Line", label_column="Clicked on Ad"):
+    """Distinct ad texts of a historical log with their click and impression counts."""
+    import pandas as pd
+    df = pd.read_csv(path, usecols=[text_column, label_column])
+    grouped = df.groupby(text_column, sort=False)[label_column].agg(["sum", "count"])
+    return grouped.index.tolist(), grouped["sum"].to_numpy(), grouped["count"].to_numpy()
+
+
+class IVFIndex:
+    """
+    CPU inverted-file index over historical ad embeddings, searched by cosine similarity.
+
+    The main segment (written by build_index/compact) is memory-mapped read-only:
+    a query scores the `nlist` centroids, then only the `nprobe` most similar
+    inverted lists, each a contiguous slice of vectors.npy. Inserted ads go to an
+    append-only delta segment next to it (delta.vec + delta.jsonl), which is
+    searched exhaustively until the next compact() folds it into a new main
+    segment. Once the delta holds `max_delta_rows` ads, insert() starts that
+    compaction in a background thread, so the exhaustive part of each search stays
+    small. Inserts and compactions made by other processes are picked up by
+    search() at most every `refresh_interval` seconds.
+    """
+
+    def __init__(self, root, nprobe=8, refresh_interval=5.0, max_delta_rows=None):
+        self.root = root
+        self.nprobe = nprobe
+        self.refresh_interval = refresh_interval
+        self.max_delta_rows = max_delta_rows
+        self._next_refresh = time.monotonic() + refresh_interval
+        self._lock = threading.Lock()
+        self._compactor = None
+        self.segment = None
+        self._open_current()
+
+    def _current(self):
+        with open(os.path.join(self.root, "CURRENT")) as f:
+            return f.read().strip()
+
+    def _open_current(self):
+        # Follow CURRENT if the segment is compacted away by another process while being opened
+        while True:
+            segment = self._current()
+            try:
+                return self._open(segment)
+            except FileNotFoundError:
+                if self._current() == segment:
+                    raise
+
+    def _open(self, segment):
+        directory = os.path.join(self.root, segment)
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != ANN_FORMAT_VERSION:
+            raise ValueError(f"ANN index {directory} has format {meta.get('version')}, expected {ANN_FORMAT_VERSION}.")
+        self.dim = meta["dim"]
+        self.centroids = np.load(os.path.join(directory, "centroids.npy"))
+        self.list_offsets = np.load(os.path.join(directory, "list_offsets.npy"))
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        self.keys = np.load(os.path.join(directory, "keys.npy"), mmap_mode="r")
+        self.clicks = np.load(os.path.join(directory, "clicks.npy"), mmap_mode="r")
+        self.impressions = np.load(os.path.join(directory, "impressions.npy"), mmap_mode="r")
+        self.text_offsets = np.load(os.path.join(directory, "text_offsets.npy"), mmap_mode="r")
+        texts_path = os.path.join(directory, "texts.bin")
+        self.texts = np.memmap(texts_path, dtype=np.uint8, mode="r") if os.path.getsize(texts_path) else np.zeros(0, np.uint8)
+        self._row_of_key = None  # built on the first insert
+
+        self._log = AppendLog(os.path.join(directory, "delta.vec"), os.path.join(directory, "delta.jsonl"),
+                              self.dim * 4)
+        self._log.create()
+        self.delta_vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self.delta_texts = []
+        self.delta_counts = []  # [clicks, impressions] per delta row
+        self.delta_rows = {}  # key -> delta row
+        self.extra_counts = {}  # main row -> [clicks, impressions] recorded after the build
+        self.segment = segment
+        self._replay()
+
+    def __len__(self):
+        return len(self.vectors) + len(self.delta_texts)
+
+    def _main_row(self, key):
+        if self._row_of_key is None:
+            # Through a V16 view: S16 tolist() would strip keys' trailing NUL bytes
+            self._row_of_key = {k: i for i, k in enumerate(self.keys.view("V16").tolist())}
+        return self._row_of_key.get(key)
+
+    def _replay(self):
+        """Apply delta.jsonl lines appended since the last replay (by any process)."""
+        n_rows = len(self.delta_texts)
+        for line in self._log.read_lines():
+            record = json.loads(line)
+            key = bytes.fromhex(record["key"])
+            if record["row"] is None:
+                # An ad of the main segment: new outcomes only
+                counts = self.extra_counts.setdefault(self._main_row(key), [0, 0])
+            else:
+                if record["row"] >= 0:
+                    # Writers append delta rows in order, so the file row is the list position
+                    self.delta_rows[key] = record["row"]
+                    self.delta_texts.append(record["text"])
+                    self.delta_counts.append([0, 0])
+                    n_rows = record["row"] + 1
+                counts = self.delta_counts[self.delta_rows[key]]
+            counts[0] += record["clicks"]
+            counts[1] += record["impressions"]
+        if n_rows > len(self.delta_vectors):
+            try:
+                stored = np.fromfile(self._log.data_path, dtype=np.float32, count=n_rows * self.dim)
+            except FileNotFoundError:
+                return self._open_current()  # removed by a compaction since the lines were read
+            self.delta_vectors = stored.reshape(n_rows, self.dim)
+
+    def refresh(self):
+        """Follow compactions and inserts made by other processes."""
+        self._next_refresh = time.monotonic() + self.refresh_interval
+        with self._lock:
+            if self._current() != self.segment:
+                self._open_current()
+            else:
+                self._replay()
+
+    def _text(self, row):
+        return bytes(self.texts[self.text_offsets[row]:self.text_offsets[row + 1]]).decode("utf-8")
+
+    def _entry(self, row, similarity):
+        if row >= 0:
+            text = self._text(row)
+            clicks, impressions = int(self.clicks[row]), int(self.impressions[row])
+            extra = self.extra_counts.get(row)
+            if extra:
+                clicks, impressions = clicks + extra[0], impressions + extra[1]
+        else:
+            text = self.delta_texts[-row - 1]
+            clicks, impressions = self.delta_counts[-row - 1]
+        return {
+            "ad_text": text,
+            "similarity": round(float(similarity), 4),
+            "clicks": clicks,
+            "impressions": impressions,
+            "ctr": round(clicks / impressions, 4) if impressions else None,
+        }
+
+    def search(self, queries, k=5, nprobe=None):
+        """The k most similar indexed ads for each query vector, most similar first."""
+        if time.monotonic() >= self._next_refresh:
+            self.refresh()
+        Q = normalize_rows(np.atleast_2d(queries))
+        while True:
+            # Score against references taken under the lock, but outside it, so
+            # concurrent searches run in parallel
+            with self._lock:
+                segment = self.segment
+                centroids, list_offsets, vectors, delta_vectors = (
+                    self.centroids, self.list_offsets, self.vectors, self.delta_vectors)
+            probe = min(nprobe or self.nprobe, len(centroids))
+            probes = np.argpartition(-(Q @ centroids.T), probe - 1, axis=1)[:, :probe]
+            hits = []
+            for q, lists in zip(Q, probes):
+                rows = np.concatenate([np.arange(list_offsets[l], list_offsets[l + 1]) for l in lists])
+                # Probed lists are contiguous slices; score them without materializing a gather
+                scores = np.concatenate([vectors[list_offsets[l]:list_offsets[l + 1]] @ q for l in lists])
+                if len(delta_vectors):
+                    # Delta rows are reported as negative ids: -1 is delta row 0
+                    rows = np.concatenate([rows, -1 - np.arange(len(delta_vectors))])
+                    scores = np.concatenate([scores, delta_vectors @ q])
+                top = np.argsort(-scores)[:k] if len(scores) <= k else np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top])]
+                hits.append([(int(rows[i]), scores[i]) for i in top])
+            with self._lock:
+                # Row ids are only meaningful in the segment they were scored against
+                if self.segment == segment:
+                    return [[self._entry(row, score) for row, score in query_hits] for query_hits in hits]
+
+    def insert(self, texts, vectors, clicks, impressions):
+        """
+        Record ads and their observed outcomes. A text already indexed only adds to
+        its counts; a new text is appended to the delta segment.
+        """
+        vectors = normalize_rows(vectors)
+        while not self._append(texts, vectors, clicks, impressions):
+            with self._lock:
+                self._open_current()  # compacted by another process: retry on the new segment
+        with self._lock:
+            self._replay()
+        self._maybe_compact()
+
+    def _append(self, texts, vectors, clicks, impressions):
+        # The log lock is taken before self._lock, as in compact(), so a compaction
+        # holding it delays inserts but never searches
+        log = self._log
+        try:
+            with log.appending() as appender, self._lock:
+                if log is not self._log or self._current() != self.segment:
+                    return False
+                self._replay()  # rows appended by other writers come first
+                pending = set()
+                for text, vector, n_clicks, n_impressions in zip(texts, vectors, clicks, impressions):
+                    key = ad_key(text)
+                    record = {"key": key.hex(), "row": None, "clicks": int(n_clicks),
+                              "impressions": int(n_impressions)}
+                    if self._main_row(key) is None and key not in self.delta_rows and key not in pending:
+                        record.update(row=appender.row, text=text)
+                        appender.write(vector.tobytes(), json.dumps(record))
+                        pending.add(key)
+                        continue
+                    if self._main_row(key) is None:
+                        record["row"] = -1  # already in the delta segment: counts only
+                    appender.write(None, json.dumps(record))
+        except FileNotFoundError:
+            return False  # segment removed by a compaction
+        return True
+
+    def _maybe_compact(self):
+        if not self.max_delta_rows or len(self.delta_texts) < self.max_delta_rows:
+            return
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(target=self._auto_compact, name="ann-compact", daemon=True)
+            self._compactor.start()
+
+    def _auto_compact(self):
+        try:
+            segment = self.compact(min_delta_rows=self.max_delta_rows)
+        except Exception as e:
+            print(f"ANN index: background compaction failed: {e}")
+            return
+        if segment:
+            print(f"ANN index: compacted the delta segment into {segment} ({len(self)} ads)")
+
+    def compact(self, retrain=False, min_delta_rows=0):
+        """
+        Fold the delta segment into a new main segment and switch to it. Lists keep
+        their centroids unless `retrain`; stale segments are removed. Searches go on
+        against the old segment while the new one is written. Returns None without
+        compacting when the delta has fewer than `min_delta_rows` ads (e.g. another
+        process has just compacted it).
+        """
+        while True:
+            with self._lock:
+                if self._current() != self.segment:
+                    self._open_current()
+                locked, log_path = self.segment, self._log.log_path
+            try:
+                log_file = open(log_path, "ab")
+            except FileNotFoundError:
+                continue  # removed by a concurrent compaction
+            with log_file, exclusive_lock(log_file):
+                with self._lock:
+                    # Another thread may have moved on to a newer segment meanwhile
+                    if self._current() != locked or self.segment != locked:
+                        continue
+                    self._replay()
+                    if len(self.delta_texts) < min_delta_rows:
+                        return None
+                    delta_texts = list(self.delta_texts)
+                    delta_counts = np.asarray(self.delta_counts, dtype=np.int64).reshape(-1, 2)
+                    delta_vectors = self.delta_vectors
+                    delta_keys = np.asarray(list(self.delta_rows), dtype="S16").reshape(-1)
+                    extra_counts = dict(self.extra_counts)
+                    main = (self.vectors, self.keys, self.clicks, self.impressions, self.centroids,
+                            self.list_offsets, self.texts, self.text_offsets)
+                main_vectors, main_keys, main_clicks, main_impressions, centroids, list_offsets, main_texts, text_offsets = main
+                # Streamed from the memory-mapped main segment into the new one: only the
+                # delta and one block of rows are in memory at a time
+                vectors = _Rows(main_vectors, delta_vectors)
+                keys = _Rows(main_keys, delta_keys)
+                clicks = _Rows(main_clicks, delta_counts[:, 0], add={row: c[0] for row, c in extra_counts.items()})
+                impressions = _Rows(main_impressions, delta_counts[:, 1], add={row: c[1] for row, c in extra_counts.items()})
+                texts = _SegmentTexts(main_texts, text_offsets, delta_texts)
+                labels = None
+                if not retrain:
+                    # Main rows stay in their lists, so each list is copied as one contiguous run
+                    labels = np.concatenate([np.repeat(np.arange(len(centroids)), np.diff(list_offsets)),
+                                             assign(delta_vectors, centroids)])
+                # Taken before writing: later segments may be compacted (under their own
+                # lock) by another process as soon as ours is published
+                stale = [name for name in os.listdir(self.root) if name.startswith("segment-")]
+                segment = f"segment-{time.time_ns()}"
+                write_segment(os.path.join(self.root, segment), vectors, keys, texts, clicks, impressions,
+                              centroids=None if retrain else centroids, labels=labels)
+                _publish(self.root, segment)
+                with self._lock:
+                    self._open(segment)
+            # Readers in other processes keep their open memmaps valid after the unlink.
+            # Every older segment goes, including any a stale writer recreated a file in.
+            for name in stale:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            return segment
+
+
+if __name__ == "__main__":
+    # Build from the training log, or fold inserted ads into the main segment:
+    #     python ann_index.py build --csv data/advertising.csv
+    #     python ann_index.py compact
+    parser = argparse.ArgumentParser(description="Similar-past-ads vector index")
+    parser.add_argument("command", choices=["build", "compact"])
+    parser.add_argument("--root", default=os.environ.get("ANN_INDEX_DIR", ".cache/ann_index"))
+    parser.add_argument("--csv", default="data/advertising.csv")
+    parser.add_argument("--nlist", type=int, help="number of inverted lists (default 4*sqrt(rows))")
+    parser.add_argument("--retrain", action="store_true", help="compact: re-cluster instead of reusing centroids")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == "build":
+        from feature_engineering import embed_texts
+        texts, clicks, impressions = history_from_csv(args.csv)
+        segment = build_index(args.root, texts, embed_texts(texts), clicks, impressions, args.nlist)
+        print(f"Indexed {len(texts)} distinct ads into {os.path.join(args.root, segment)} "
+              f"({time.perf_counter() - start:.1f}s)")
+    else:
+        index = IVFIndex(args.root)
+        segment = index.compact(retrain=args.retrain)
+        print(f"Compacted {len(index)} ads into {os.path.join(args.root, segment)} ({time.perf_counter() - start:.1f}s)")
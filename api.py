@@ -1,76 +1,152 @@
 # api.py
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import pandas as pd
-import joblib
+from typing import Dict, List, Optional, Union
+from starlette.concurrency import run_in_threadpool
+import numpy as np
+import hmac
 import json
+import os
 import re
-from feature_engineering import create_features
+import threading
+import time
+from feature_engineering import embed_texts, embedding_cache, embedding_service
+from resources import resources
+import llm
+from lexicon import LexiconEngine
+import sweep
+from explain import breakdowns
+from model_registry import NATIVE_FORMATS, build_registry
+from ann_index import IVFIndex
+import metrics
 from fastapi.middleware.cors import CORSMiddleware
 
-# Ethical heuristic keywords
-PRIVACY_KEYWORDS = {
-    'your friend', 'your friends', 'we saw you', 'based on your', 
-    'people like you', 'your recent activity', 'know you like', 'saw you looked at'
-}
+# Ethical heuristic lexicons: built-in defaults, or <category>.txt files in
+# LEXICON_DIR (hot-reloaded when they change)
+lexicon_engine = LexiconEngine(
+    os.environ.get("LEXICON_DIR") or None,
+    reload_interval=float(os.environ.get("LEXICON_RELOAD_S", "5")),
+)
 
-URGENCY_KEYWORDS = {
-    'limited time', 'only a few left', 'offer expires', "don't miss out", 
-    'today only', 'hurry', 'last chance', '24-hour', 'now or never'
-}
+def _load_registry():
+    # Versioned models (MODEL_REGISTRY_CONFIG, or the default saved_model/ model); each
+    # version's feature plan and explainer are built once when it is registered.
+    # MODEL_REGISTRY_STATE shares admin changes between worker processes (set by serve.py)
+    return build_registry(os.environ.get("MODEL_REGISTRY_CONFIG") or None,
+                          os.environ.get("MODEL_REGISTRY_STATE") or None)
 
-MEDICAL_KEYWORDS = {
-    'guaranteed cure', 'miracle', '100% safe', 'doctors hate this', 
-    'magic pill', 'instant weight loss', 'cure your', 'secret remedy'
-}
+resources.register("model_registry", _load_registry)
 
-FINANCIAL_KEYWORDS = {
-    'get rich quick', 'guaranteed return', 'no risk', 'earn fast',
-    'make millions', 'double your money', 'secret wealth', 'financial freedom guaranteed'
-}
+def _load_ann_index():
+    # Similar-past-ads index built by `python ann_index.py build`; optional
+    root = os.environ.get("ANN_INDEX_DIR", ".cache/ann_index")
+    if not root or not os.path.exists(os.path.join(root, "CURRENT")):
+        return None
+    return IVFIndex(root, nprobe=int(os.environ.get("ANN_NPROBE", "8")),
+                    max_delta_rows=int(os.environ.get("ANN_MAX_DELTA_ROWS", "10000")) or None)
 
-def count_keywords(text, keywords):
-    text = text.lower()
-    return sum(1 for keyword in keywords if keyword in text)
+# Looked for again every ANN_RETRY_S seconds until an index is built
+resources.register("ann_index", _load_ann_index, retry_missing_s=float(os.environ.get("ANN_RETRY_S", "30")))
 
-import os
-from groq import Groq
+# Number of similar past ads returned by /predict (0 disables the lookup)
+SIMILAR_ADS_K = int(os.environ.get("SIMILAR_ADS_K", "5"))
 
-def get_ethical_rewrite(ad_text, creepiness, urgency, medical, financial):
-    if creepiness == 0 and urgency == 0 and medical == 0 and financial == 0:
-        return None
-    api_key = os.environ.get("GROQ_API_KEY")
-    if not api_key:
-        return "⚠️ Set GROQ_API_KEY in your environment to see AI suggested rewrites."
-        
+# Upper bound on the number of cells a single /sweep request may score
+MAX_SWEEP_CELLS = int(os.environ.get("MAX_SWEEP_CELLS", "10000"))
+
+def model_loaded():
     try:
-        client = Groq(api_key=api_key)
-        prompt = f"Rewrite the following ad copy to sound professional, ethical, and compliant. Remove any creepy tracking language, aggressive urgency/scarcity tactics, unverified medical claims, or 'get rich quick' financial promises. Return ONLY the rewritten ad text without any conversational filler or quotation marks. Ad to rewrite: '{ad_text}'"
-        chat_completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.1-8b-instant",
-        )
-        return chat_completion.choices[0].message.content.strip()
-    except Exception as e:
-        return f"⚠️ Error generating rewrite: {str(e)}"
+        return resources.get("model_registry").active is not None
+    except FileNotFoundError:
+        return False
 
-def get_counterfactual_advice(ad_text, shap_breakdown):
-    api_key = os.environ.get("GROQ_API_KEY")
-    if not api_key:
-        return "⚠️ Set GROQ_API_KEY in your environment to see counterfactual advice."
-        
+def select_version(requested=None):
+    """The model version for one request: pinned by name, or chosen by the traffic routing."""
+    registry = resources.get("model_registry")
+    if requested is None:
+        version = registry.route()
+    else:
+        try:
+            version = registry.get(requested)
+        except KeyError:
+            raise HTTPException(status_code=404, detail=f"Unknown model version '{requested}'.")
+    metrics.set_label("model_version", version.name)
+    return version
+
+# Startup state reported by /readyz
+startup_report = {"ready": False, "components": {}, "warmup_seconds": None, "total_seconds": None, "error": None}
+
+def warmup():
+    """Load every resource and push one synthetic ad through all CPU stages of the pipeline."""
+    start = time.perf_counter()
     try:
-        client = Groq(api_key=api_key)
-        prompt = f"You are an expert digital marketing strategist. An ad copy '{ad_text}' was evaluated by an ML model and received the following SHAP impact scores for its features: {shap_breakdown}. Provide a single, concise sentence of actionable advice on how to rewrite or adjust the ad strategy to improve the score, specifically targeting the features with negative scores (if any). Do not use introductory filler, just give the advice directly."
-        chat_completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model="llama-3.1-8b-instant",
-        )
-        return chat_completion.choices[0].message.content.strip()
+        for name in resources.names():
+            resources.get(name)
+        warm_start = time.perf_counter()
+        warmup_text = "Warmup: limited time offer based on your recent activity"
+        # Encode directly as well: the scoring pass may be served from the embedding cache
+        resources.get("embedding_model").encode([warmup_text])
+        score_ad(resources.get("model_registry").active, warmup_text, 35, 60000.0, "All", 9, 0, SIMILAR_ADS_K)
+        startup_report["warmup_seconds"] = round(time.perf_counter() - warm_start, 4)
+        startup_report["ready"] = True
+    except FileNotFoundError:
+        print("FATAL ERROR: Model files not found in 'saved_model/'.")
+        startup_report["error"] = "Model files not found in 'saved_model/'."
     except Exception as e:
-        return f"⚠️ Error generating advice: {str(e)}"
+        print(f"Warmup failed: {e}")
+        startup_report["error"] = str(e)
+    startup_report["components"] = resources.timings()
+    startup_report["total_seconds"] = round(time.perf_counter() - start, 4)
+
+def watch_models():
+    # Hot-swap models whose files change (MODEL_WATCH_S=0 disables polling)
+    watch_interval = float(os.environ.get("MODEL_WATCH_S", "5"))
+    if watch_interval > 0 and resources.is_loaded("model_registry"):
+        resources.get("model_registry").watch(watch_interval)
+
+def warmup_and_watch():
+    warmup()
+    watch_models()
+
+async def ensure_model_loaded():
+    """
+    Whether the model registry is loaded, for async handlers. Never loads on the
+    event loop: while warmup is loading it (or after it failed) this is False, and
+    with WARMUP=0 the lazy load runs in a worker thread.
+    """
+    if resources.is_loaded("model_registry"):
+        return True
+    if not startup_report["ready"]:
+        return False
+    if await run_in_threadpool(model_loaded):
+        watch_models()
+        return True
+    return False
+
+def model_unavailable():
+    detail = startup_report["error"] or "Model is still loading."
+    return JSONResponse({"error": f"Model is not loaded: {detail}"}, status_code=503)
 
-app = FastAPI(title="Ethical Ad Predictor API", description="Hybrid Multi-Modal Predictor")
+@asynccontextmanager
+async def lifespan(app):
+    # Coalesce concurrent encode calls from the request threads into batches
+    if os.environ.get("EMBEDDING_BATCHING", "1") != "0":
+        embedding_service.start()
+    # Warm up off the event loop so /healthz answers while models load; the model
+    # watcher starts from the same thread once the registry is there
+    if os.environ.get("WARMUP", "1") != "0":
+        threading.Thread(target=warmup_and_watch, name="warmup", daemon=True).start()
+    else:
+        startup_report["ready"] = True
+        watch_models()
+    yield
+    embedding_service.stop()
+    if resources.is_loaded("model_registry"):
+        resources.get("model_registry").stop_watching()
+
+app = FastAPI(title="Ethical Ad Predictor API", description="Hybrid Multi-Modal Predictor", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -78,6 +154,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browser devtools show the per-stage breakdown for cross-origin calls
+    expose_headers=["Server-Timing"],
+)
+
+# Per-stage latency histograms, Server-Timing headers and sampled outlier profiles.
+# PROFILE_SAMPLE_RATE (default 0) is the fraction of requests stack-sampled; profiles
+# of those slower than PROFILE_OUTLIER_MS are served at /debug/profiles
+app.add_middleware(
+    metrics.MetricsMiddleware,
+    profile_sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", "0")),
+    profile_outlier_ms=float(os.environ.get("PROFILE_OUTLIER_MS", "500")),
 )
 
 class AdInput(BaseModel):
@@ -88,132 +175,197 @@ class AdInput(BaseModel):
     target_gender: str = "All"
     hour: int = 9
     day_of_week: int = 0
-
-try:
-    model = joblib.load('saved_model/model.joblib')
-    with open('saved_model/model_columns.json', 'r') as f:
-        model_columns = json.load(f)
-        
-    # Initialize SHAP explainer
-    import shap
-    explainer = shap.TreeExplainer(model)
-except FileNotFoundError:
-    print("FATAL ERROR: Model files not found in 'saved_model/'.")
-    model = None
-    explainer = None
+    # Return the score immediately and deliver the LLM rewrite/advice later via /jobs/{id}
+    defer_llm: bool = False
+    # Pin a registered model version instead of using the traffic routing
+    model_version: Optional[str] = None
 
 @app.get("/")
 def read_root():
-    return {"status": "API is running. Model loaded successfully." if model else "API is running, but MODEL IS MISSING."}
+    return {"status": "API is running. Model loaded successfully." if model_loaded() else "API is running, but MODEL IS MISSING."}
 
-@app.post("/predict")
-def predict(ad_input: AdInput):
-    if not model:
-        return {"error": "Model is not loaded. Check server logs."}
-
-    # 1. Ethical & Compliance Heuristics
-    creepiness_score_val = count_keywords(ad_input.ad_text, PRIVACY_KEYWORDS)
-    urgency_score_val = count_keywords(ad_input.ad_text, URGENCY_KEYWORDS)
-    medical_score_val = count_keywords(ad_input.ad_text, MEDICAL_KEYWORDS)
-    financial_score_val = count_keywords(ad_input.ad_text, FINANCIAL_KEYWORDS)
-
-    # 2. Map frontend inputs to model features
-    is_male = 1 if ad_input.target_gender == "Male" else 0
+@app.get("/healthz")
+def healthz():
+    # Liveness: the process is up and serving; says nothing about models
+    return {"status": "ok"}
+
+@app.get("/readyz")
+def readyz():
+    # Readiness: models loaded and warmed; load balancers should wait for 200
+    return JSONResponse(startup_report, status_code=200 if startup_report["ready"] else 503)
+
+@app.get("/cache_stats")
+def cache_stats():
+    # Hit/miss/eviction counters for sizing EMBEDDING_CACHE_MB
+    return {
+        "embedding_cache": embedding_cache.stats(),
+        "embedding_service": embedding_service.stats(),
+        "llm_cache": llm.completion_cache.stats(),
+        "llm_jobs": len(llm.llm_jobs),
+    }
+
+def _embedding_cache_counts():
+    stats = embedding_cache.stats()
+    return {("memory",): stats["hits"], ("disk",): stats["disk_hits"], ("miss",): stats["misses"]}
+
+def _llm_cache_counts():
+    stats = llm.completion_cache.stats()
+    return {("hit",): stats["hits"], ("miss",): stats["misses"]}
+
+def _model_versions():
+    registry = resources.get("model_registry") if resources.is_loaded("model_registry") else None
+    return len(registry) if registry is not None else None
+
+# Cache, queue and registry state, read only when /metrics is scraped
+metrics.registry.counter("adpredictor_embedding_cache_lookups_total", "Embedding cache lookups by outcome.",
+                         _embedding_cache_counts, ("result",))
+metrics.registry.counter("adpredictor_embedding_cache_evictions_total", "Embeddings evicted from the in-memory cache.",
+                         lambda: embedding_cache.stats()["evictions"])
+metrics.registry.gauge("adpredictor_embedding_cache_bytes", "Bytes held by the in-memory embedding cache.",
+                       lambda: embedding_cache.stats()["bytes"])
+metrics.registry.gauge("adpredictor_embedding_cache_entries", "Embeddings held in memory.",
+                       lambda: embedding_cache.stats()["entries"])
+metrics.registry.gauge("adpredictor_embedding_queue_depth", "Texts waiting for the embedding batcher.",
+                       embedding_service.queue_depth)
+metrics.registry.counter("adpredictor_embedding_batches_total", "Encode batches run by the embedding batcher.",
+                         lambda: embedding_service.batches)
+metrics.registry.counter("adpredictor_llm_cache_lookups_total", "LLM completion cache lookups by outcome.",
+                         _llm_cache_counts, ("result",))
+metrics.registry.gauge("adpredictor_llm_cache_entries", "Cached LLM completions.", lambda: len(llm.completion_cache))
+metrics.registry.gauge("adpredictor_llm_jobs", "Deferred LLM jobs held for polling.", lambda: len(llm.llm_jobs))
+metrics.registry.gauge("adpredictor_model_versions", "Registered model versions.", _model_versions)
+metrics.registry.gauge("adpredictor_ann_index_ads", "Ads in the similar-past-ads index.",
+                       lambda: len(resources.get("ann_index")) if resources.is_loaded("ann_index") and resources.get("ann_index") else None)
+
+@app.get("/metrics")
+def prometheus_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+def build_feature_rows(version, texts, target_age, area_income, target_gender, hour, day_of_week):
+    """Float32 feature matrix (one row per text, shared targeting) in model column order."""
+    # Map frontend inputs to model features
+    is_male = 1 if target_gender == "Male" else 0
     
     input_data = {
-        'Ad Topic Line': ad_input.ad_text,
-        'Age': ad_input.target_age,
-        'Area Income': ad_input.area_income,
+        'Age': target_age,
+        'Area Income': area_income,
         'Male': is_male,
-        'Hour': ad_input.hour,
-        'DayOfWeek': ad_input.day_of_week
-    }
-    
-    df = pd.DataFrame([input_data])
-    
-    # 3. Generate NLP Embeddings and tabular features
-    features_df = create_features(df, is_training=False)
-    
-    # 4. Predict
-    live_df = features_df[model_columns]
-    
-    # predict_proba returns array like [[prob_class_0, prob_class_1]]
-    prob_click = model.predict_proba(live_df)[0][1]
-    
-    # 5. Audience Insights Batch Prediction
-    base_row = live_df.iloc[[0]].copy()
-    
-    ages_to_test = [21, 30, 40, 50, 60]
-    age_labels = ["18-24", "25-34", "35-44", "45-54", "55+"]
-    age_df = pd.concat([base_row]*len(ages_to_test), ignore_index=True)
-    age_df['Age'] = ages_to_test
-    age_scores = model.predict_proba(age_df)[:, 1]
-    
-    incomes_to_test = [30000, 50000, 70000, 90000]
-    income_labels = ["<$40k", "$40k-$60k", "$60k-$80k", ">$80k"]
-    inc_df = pd.concat([base_row]*len(incomes_to_test), ignore_index=True)
-    inc_df['Area Income'] = incomes_to_test
-    inc_scores = model.predict_proba(inc_df)[:, 1]
-    
-    audience_insights = {
-        "age_performance": [{"label": lbl, "score": round(float(score) * 100, 2)} for lbl, score in zip(age_labels, age_scores)],
-        "income_performance": [{"label": lbl, "score": round(float(score) * 100, 2)} for lbl, score in zip(income_labels, inc_scores)]
+        'Hour': hour,
+        'DayOfWeek': day_of_week
     }
     
-    # 6. Explain with SHAP
-    shap_values = explainer.shap_values(live_df)
-    
-    sv = shap_values[0] if isinstance(shap_values, list) else shap_values[0]
-    
-    shap_breakdown = {
-        "Ad Copy Text": 0.0,
-        "Target Age": 0.0,
-        "Area Income": 0.0,
-        "Target Gender": 0.0,
-        "Schedule (Time & Day)": 0.0
-    }
+    # Embeddings (cached/batched, then reduced if the model was trained that way)
+    # are written straight into the preallocated rows
+    with metrics.stage("features"):
+        embeddings = embed_texts(texts)
+        if version.reducer is not None:
+            embeddings = version.reducer.transform(embeddings)
+        return version.plan.assemble([input_data] * len(texts), embeddings)
+
+def score_ad(version, text, target_age, area_income, target_gender, hour, day_of_week, similar_k=0):
+    """CPU-bound part of the pipeline: everything in a /predict response except the LLM fields."""
+    return score_ads(version, [text], target_age, area_income, target_gender, hour, day_of_week, similar_k)[0]
+
+def score_ads(version, texts, target_age, area_income, target_gender, hour, day_of_week, similar_k=0):
+    """
+    score_ad for several texts sharing one targeting context. Every stage runs once
+    for the whole batch: one encode call, one predict, one audience what-if call and
+    one explain call. With `similar_k`, each result also lists the most similar
+    past ads from the ANN index (when one is built).
+    """
+    booster = version.booster
+
+    # 1. Ethical & Compliance Heuristics (one pass over each text for all categories)
+    with metrics.stage("heuristics"):
+        scans = [lexicon_engine.scan(text) for text in texts]
+
+    # 2-4. Build the feature rows and predict
+    rows = build_feature_rows(version, texts, target_age, area_income, target_gender, hour, day_of_week)
+    with metrics.stage("predict"):
+        prob_clicks = sweep.score_rows(booster, rows)
     
-    for i, col in enumerate(model_columns):
-        val = sv[i]
-        if col.startswith('emb_'):
-            shap_breakdown["Ad Copy Text"] += val
-        elif col == 'Age':
-            shap_breakdown["Target Age"] += val
-        elif col == 'Area Income':
-            shap_breakdown["Area Income"] += val
-        elif col == 'Male':
-            shap_breakdown["Target Gender"] += val
-        elif col in ['Hour', 'DayOfWeek']:
-            shap_breakdown["Schedule (Time & Day)"] += val
-            
-    for k in shap_breakdown:
-        shap_breakdown[k] = round(float(shap_breakdown[k]), 2)
+    # 5. Audience Insights (one batched model call over all what-if rows)
+    with metrics.stage("audience_insights"):
+        audience_insights = sweep.audience_insights_batch(booster, rows, version.plan.column_index)
     
-    # 7. Ethical AI Rewrite
-    suggested_rewrite = get_ethical_rewrite(ad_input.ad_text, creepiness_score_val, urgency_score_val, medical_score_val, financial_score_val)
+    # 6. Explain: per-feature contributions folded into the response groups
+    with metrics.stage("explain"):
+        shap_breakdowns = breakdowns(version.explainer, rows)
     
-    # Check for Fairness Warning (Arbitrary threshold for demo)
-    fairness_warning = None
-    if ad_input.target_gender != "All" and abs(shap_breakdown["Target Gender"]) > 0.5:
-        fairness_warning = f"Warning: Ad performance is heavily skewed towards {ad_input.target_gender} audiences."
+    # 6b. Similar past ads and their observed CTR (embeddings come from the cache)
+    similar = None
+    ann_index = resources.get("ann_index") if similar_k else None
+    if ann_index is not None:
+        with metrics.stage("similar_ads"):
+            similar = ann_index.search(embed_texts(texts), k=similar_k)
 
-    # 8. Counterfactual Advice
-    counterfactual = get_counterfactual_advice(ad_input.ad_text, shap_breakdown)
-    
-    return {
-        "predicted_performance_score": round(float(prob_click * 100), 2),
-        "ethical_risk_assessment": {
-            "creepiness_score": creepiness_score_val,
-            "urgency_score": urgency_score_val,
-            "medical_claims_score": medical_score_val,
-            "financial_promises_score": financial_score_val,
-            "fairness_warning": fairness_warning
-        },
-        "shap_breakdown": shap_breakdown,
-        "suggested_rewrite": suggested_rewrite,
-        "counterfactual_advice": counterfactual,
-        "audience_insights": audience_insights
-    }
+    results = []
+    for (keyword_counts, keyword_matches), prob_click, insights, shap_breakdown in zip(
+            scans, prob_clicks, audience_insights, shap_breakdowns):
+        # Check for Fairness Warning (Arbitrary threshold for demo)
+        fairness_warning = None
+        if target_gender != "All" and abs(shap_breakdown["Target Gender"]) > 0.5:
+            fairness_warning = f"Warning: Ad performance is heavily skewed towards {target_gender} audiences."
+
+        # 7/8. Ethical AI Rewrite and Counterfactual Advice are filled in by the async layer
+        results.append({
+            "predicted_performance_score": round(float(prob_click * 100), 2),
+            "ethical_risk_assessment": {
+                "creepiness_score": keyword_counts.get('privacy', 0),
+                "urgency_score": keyword_counts.get('urgency', 0),
+                "medical_claims_score": keyword_counts.get('medical', 0),
+                "financial_promises_score": keyword_counts.get('financial', 0),
+                "fairness_warning": fairness_warning,
+                "keyword_matches": keyword_matches
+            },
+            "shap_breakdown": shap_breakdown,
+            "suggested_rewrite": None,
+            "counterfactual_advice": None,
+            "audience_insights": insights,
+            "model_version": version.name
+        })
+        if similar is not None:
+            results[-1]["similar_past_ads"] = similar[len(results) - 1]
+    return results
+
+# Stage name of each LLM output in metrics and Server-Timing
+LLM_STAGES = {"suggested_rewrite": "rewrite", "counterfactual_advice": "counterfactual"}
+
+async def attach_llm_outputs(targets, defer):
+    """
+    Fill the LLM fields of each (result, ad_text) pair. All calls run concurrently;
+    with `defer` they run in the background and a job descriptor is returned instead.
+    """
+    calls = {}
+    for prefix, (result, ad_text) in targets.items():
+        for field, coro in llm.ad_calls(result, ad_text).items():
+            calls[f"{prefix}.{field}" if prefix else field] = metrics.timed(LLM_STAGES[field], coro)
+    if not calls:
+        return None
+    if defer:
+        job_id = llm.llm_jobs.submit(calls)
+        return {"id": job_id, "poll_url": f"/jobs/{job_id}", "events_url": f"/jobs/{job_id}/events"}
+    outputs = await llm.run_calls(calls)
+    for prefix, (result, _) in targets.items():
+        for field in ("suggested_rewrite", "counterfactual_advice"):
+            result[field] = outputs[f"{prefix}.{field}" if prefix else field]
+    return None
+
+@app.post("/predict")
+async def predict(ad_input: AdInput):
+    if not await ensure_model_loaded():
+        return model_unavailable()
+
+    version = select_version(ad_input.model_version)
+    result = await run_in_threadpool(
+        score_ad, version, ad_input.ad_text, ad_input.target_age, ad_input.area_income,
+        ad_input.target_gender, ad_input.hour, ad_input.day_of_week, SIMILAR_ADS_K)
+
+    job = await attach_llm_outputs({"": (result, ad_input.ad_text)}, ad_input.defer_llm)
+    if job:
+        result["llm_job"] = job
+    return result
 
 class ABTestInput(BaseModel):
     ad_text_a: str
@@ -223,87 +375,21 @@ class ABTestInput(BaseModel):
     target_gender: str = "All"
     hour: int = 9
     day_of_week: int = 0
+    defer_llm: bool = False
+    model_version: Optional[str] = None
 
 @app.post("/ab_test")
-def ab_test(ab_input: ABTestInput):
-    if not model:
-        return {"error": "Model is not loaded. Check server logs."}
-        
-    def process_ad(text):
-        creepiness = count_keywords(text, PRIVACY_KEYWORDS)
-        urgency = count_keywords(text, URGENCY_KEYWORDS)
-        medical = count_keywords(text, MEDICAL_KEYWORDS)
-        financial = count_keywords(text, FINANCIAL_KEYWORDS)
-        
-        is_male = 1 if ab_input.target_gender == "Male" else 0
-        input_data = {
-            'Ad Topic Line': text,
-            'Age': ab_input.target_age,
-            'Area Income': ab_input.area_income,
-            'Male': is_male,
-            'Hour': ab_input.hour,
-            'DayOfWeek': ab_input.day_of_week
-        }
-        df = pd.DataFrame([input_data])
-        features_df = create_features(df, is_training=False)
-        live_df = features_df[model_columns]
-        prob_click = float(model.predict_proba(live_df)[0][1])
-        
-        shap_values = explainer.shap_values(live_df)
-        sv = shap_values[0] if isinstance(shap_values, list) else shap_values[0]
-        
-        shap_breakdown = { "Ad Copy Text": 0.0, "Target Age": 0.0, "Area Income": 0.0, "Target Gender": 0.0, "Schedule (Time & Day)": 0.0 }
-        for i, col in enumerate(model_columns):
-            val = float(sv[i])
-            if col.startswith('emb_'): shap_breakdown["Ad Copy Text"] += val
-            elif col == 'Age': shap_breakdown["Target Age"] += val
-            elif col == 'Area Income': shap_breakdown["Area Income"] += val
-            elif col == 'Male': shap_breakdown["Target Gender"] += val
-            elif col in ['Hour', 'DayOfWeek']: shap_breakdown["Schedule (Time & Day)"] += val
-                
-        for k in shap_breakdown:
-            shap_breakdown[k] = round(shap_breakdown[k], 2)
-            
-        base_row = live_df.iloc[[0]].copy()
-        
-        ages_to_test = [21, 30, 40, 50, 60]
-        age_labels = ["18-24", "25-34", "35-44", "45-54", "55+"]
-        age_df = pd.concat([base_row]*len(ages_to_test), ignore_index=True)
-        age_df['Age'] = ages_to_test
-        age_scores = model.predict_proba(age_df)[:, 1]
-        
-        incomes_to_test = [30000, 50000, 70000, 90000]
-        income_labels = ["<$40k", "$40k-$60k", "$60k-$80k", ">$80k"]
-        inc_df = pd.concat([base_row]*len(incomes_to_test), ignore_index=True)
-        inc_df['Area Income'] = incomes_to_test
-        inc_scores = model.predict_proba(inc_df)[:, 1]
-        
-        audience_insights = {
-            "age_performance": [{"label": lbl, "score": round(float(score) * 100, 2)} for lbl, score in zip(age_labels, age_scores)],
-            "income_performance": [{"label": lbl, "score": round(float(score) * 100, 2)} for lbl, score in zip(income_labels, inc_scores)]
-        }
-            
-        fairness_warning = None
-        if ab_input.target_gender != "All" and abs(shap_breakdown["Target Gender"]) > 0.5:
-            fairness_warning = f"Warning: Ad performance is heavily skewed towards {ab_input.target_gender} audiences."
-
-        return {
-            "predicted_performance_score": round(prob_click * 100, 2),
-            "ethical_risk_assessment": { 
-                "creepiness_score": creepiness, 
-                "urgency_score": urgency,
-                "medical_claims_score": medical,
-                "financial_promises_score": financial,
-                "fairness_warning": fairness_warning
-            },
-            "shap_breakdown": shap_breakdown,
-            "suggested_rewrite": get_ethical_rewrite(text, creepiness, urgency, medical, financial),
-            "counterfactual_advice": get_counterfactual_advice(text, shap_breakdown),
-            "audience_insights": audience_insights
-        }
+async def ab_test(ab_input: ABTestInput):
+    if not await ensure_model_loaded():
+        return model_unavailable()
 
-    res_a = process_ad(ab_input.ad_text_a)
-    res_b = process_ad(ab_input.ad_text_b)
+    # Both variants are scored by the same model version, in one batch
+    version = select_version(ab_input.model_version)
+    res_a, res_b = await run_in_threadpool(
+        score_ads, version, [ab_input.ad_text_a, ab_input.ad_text_b], ab_input.target_age,
+        ab_input.area_income, ab_input.target_gender, ab_input.hour, ab_input.day_of_week)
+    job = await attach_llm_outputs(
+        {"ad_a": (res_a, ab_input.ad_text_a), "ad_b": (res_b, ab_input.ad_text_b)}, ab_input.defer_llm)
     
     score_a = res_a["predicted_performance_score"]
     score_b = res_b["predicted_performance_score"]
@@ -318,9 +404,281 @@ def ab_test(ab_input: ABTestInput):
         winner = "Tie"
         lift = 0.0
         
-    return {
+    response = {
         "ad_a": res_a,
         "ad_b": res_b,
         "winner": winner,
         "expected_lift": round(lift, 2)
-    }
\ No newline at end of file
+    }
+    if job:
+        response["llm_job"] = job
+    return response
+
+# Upper bound on the number of variants a single /rank_variants request may rank
+MAX_RANK_VARIANTS = int(os.environ.get("MAX_RANK_VARIANTS", "100"))
+# Upper bound on LLM-generated entries per request, whatever top_k and the flags ask for
+MAX_LLM_VARIANTS = int(os.environ.get("MAX_LLM_VARIANTS", "10"))
+
+class RankInput(BaseModel):
+    ad_texts: List[str]
+    target_age: int = 35
+    area_income: float = 60000.0
+    target_gender: str = "All"
+    hour: int = 9
+    day_of_week: int = 0
+    # LLM rewrite/advice only for the best `top_k` variants, plus (with
+    # `llm_for_flagged`) any variant with an ethical risk or fairness flag,
+    # at most `max_llm_variants` (and MAX_LLM_VARIANTS) of them: top_k first,
+    # then flagged variants by rank
+    top_k: int = 3
+    llm_for_flagged: bool = True
+    max_llm_variants: Optional[int] = None
+    defer_llm: bool = False
+    model_version: Optional[str] = None
+
+def is_flagged(result):
+    risk = result["ethical_risk_assessment"]
+    return bool(risk["fairness_warning"]) or any(
+        risk[k] > 0 for k in ("creepiness_score", "urgency_score", "medical_claims_score", "financial_promises_score"))
+
+@app.post("/rank_variants")
+async def rank_variants(rank_input: RankInput):
+    if not await ensure_model_loaded():
+        return model_unavailable()
+    if not rank_input.ad_texts:
+        raise HTTPException(status_code=400, detail="ad_texts is empty.")
+    if rank_input.top_k < 0:
+        raise HTTPException(status_code=400, detail="top_k must be non-negative.")
+    if rank_input.max_llm_variants is not None and rank_input.max_llm_variants < 0:
+        raise HTTPException(status_code=400, detail="max_llm_variants must be non-negative.")
+
+    # Identical texts are scored once; each ranked entry lists every input position it covers
+    positions = {}
+    for i, text in enumerate(rank_input.ad_texts):
+        positions.setdefault(text, []).append(i)
+    texts = list(positions)
+    if len(texts) > MAX_RANK_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"{len(texts)} distinct variants; the limit is {MAX_RANK_VARIANTS}.")
+
+    # All variants share the targeting context and go through each stage as one batch
+    version = select_version(rank_input.model_version)
+    results = await run_in_threadpool(
+        score_ads, version, texts, rank_input.target_age, rank_input.area_income,
+        rank_input.target_gender, rank_input.hour, rank_input.day_of_week)
+
+    order = sorted(range(len(texts)), key=lambda i: results[i]["predicted_performance_score"], reverse=True)
+    best_score = results[order[0]]["predicted_performance_score"]
+    ranked = []
+    for rank, i in enumerate(order, start=1):
+        score = results[i]["predicted_performance_score"]
+        ranked.append({
+            "rank": rank,
+            "ad_text": texts[i],
+            "input_indices": positions[texts[i]],
+            # Relative to the best variant, as in /ab_test's expected_lift (0 for the best, negative otherwise)
+            "lift_vs_best": round(((score - best_score) / max(best_score, 0.01)) * 100, 2),
+            "llm_generated": False,
+            **results[i],
+        })
+
+    # LLM cost is bounded per request, however many variants are flagged
+    llm_limit = min(MAX_LLM_VARIANTS, rank_input.max_llm_variants if rank_input.max_llm_variants is not None else MAX_LLM_VARIANTS)
+    best = [entry for entry in ranked if entry["rank"] <= rank_input.top_k]
+    flagged = [entry for entry in ranked
+               if entry["rank"] > rank_input.top_k and rank_input.llm_for_flagged and is_flagged(entry)]
+    for entry in (best + flagged)[:llm_limit]:
+        entry["llm_generated"] = True
+
+    job = await attach_llm_outputs(
+        {f"rank_{entry['rank']}": (entry, entry["ad_text"]) for entry in ranked if entry["llm_generated"]},
+        rank_input.defer_llm)
+
+    response = {
+        "variants": ranked,
+        "best": ranked[0]["ad_text"],
+        "n_inputs": len(rank_input.ad_texts),
+        "n_unique": len(texts),
+        "model_version": version.name
+    }
+    if job:
+        response["llm_job"] = job
+    return response
+
+class SweepInput(BaseModel):
+    ad_text: str
+    target_age: int = 35
+    area_income: float = 60000.0
+    target_gender: str = "All"
+    hour: int = 9
+    day_of_week: int = 0
+    # Axis name (age, income, gender, hour, day_of_week) -> values to try.
+    # Gender values may be "Male"/"Female"/"All" or 0/1.
+    axes: Dict[str, List[Union[float, str]]]
+    model_version: Optional[str] = None
+
+def score_sweep(version, sweep_input, axes):
+    # Grid build and scoring; CPU-bound, so run in a worker thread
+    base_row = build_feature_rows(
+        version, [sweep_input.ad_text], sweep_input.target_age, sweep_input.area_income,
+        sweep_input.target_gender, sweep_input.hour, sweep_input.day_of_week)[0]
+    with metrics.stage("sweep"):
+        return sweep.sweep(version.booster, base_row, version.plan.column_index, axes)
+
+@app.post("/sweep")
+async def sweep_grid(sweep_input: SweepInput):
+    if not await ensure_model_loaded():
+        return model_unavailable()
+
+    axes = {}
+    for name, values in sweep_input.axes.items():
+        if name not in sweep.SWEEP_AXES:
+            raise HTTPException(status_code=400, detail=f"Unknown sweep axis '{name}'. Valid axes: {', '.join(sweep.SWEEP_AXES)}.")
+        if not values:
+            raise HTTPException(status_code=400, detail=f"Sweep axis '{name}' has no values.")
+        if name == "gender":
+            values = [(1 if v == "Male" else 0) if isinstance(v, str) else v for v in values]
+        elif any(isinstance(v, str) for v in values):
+            raise HTTPException(status_code=400, detail=f"Sweep axis '{name}' must be numeric.")
+        axes[name] = values
+    n_cells = int(np.prod([len(v) for v in axes.values()]))
+    if n_cells > MAX_SWEEP_CELLS:
+        raise HTTPException(status_code=400, detail=f"Sweep grid has {n_cells} cells; the limit is {MAX_SWEEP_CELLS}.")
+
+    version = select_version(sweep_input.model_version)
+    scores = await run_in_threadpool(score_sweep, version, sweep_input, axes)
+
+    return {
+        "axes": {name: list(sweep_input.axes[name]) for name in axes},
+        "shape": list(scores.shape),
+        "scores": np.round(scores.astype(np.float64) * 100, 2).tolist(),
+        "model_version": version.name
+    }
+
+class PastAd(BaseModel):
+    ad_text: str
+    clicks: int = 0
+    impressions: int = 0
+
+class PastAdsInput(BaseModel):
+    ads: List[PastAd]
+
+@app.post("/past_ads")
+def insert_past_ads(past_ads: PastAdsInput, x_admin_token: Optional[str] = Header(None)):
+    # Add served ads (or new outcomes of indexed ones) to the similar-past-ads index
+    require_admin(x_admin_token)
+    ann_index = resources.get("ann_index")
+    if ann_index is None:
+        raise HTTPException(status_code=503, detail="No ANN index. Build one with `python ann_index.py build`.")
+    if any(ad.clicks < 0 or ad.impressions < ad.clicks for ad in past_ads.ads):
+        raise HTTPException(status_code=400, detail="Each ad needs 0 <= clicks <= impressions.")
+    texts = [ad.ad_text for ad in past_ads.ads]
+    ann_index.insert(texts, embed_texts(texts), [ad.clicks for ad in past_ads.ads],
+                     [ad.impressions for ad in past_ads.ads])
+    return {"inserted": len(texts), "index_size": len(ann_index)}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = llm.llm_jobs.poll(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job id.")
+    return {"id": job_id, **job}
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job(job_id: str):
+    events = llm.llm_jobs.stream(job_id)
+    if events is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job id.")
+
+    async def event_stream():
+        async for field, value in events:
+            yield f"event: result\ndata: {json.dumps({'field': field, 'value': value})}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+def require_admin(x_admin_token):
+    # Admin endpoints are disabled unless ADMIN_TOKEN is set (constant-time comparison)
+    token = os.environ.get("ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them.")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode("utf-8"), token.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Invalid admin token.")
+
+# Directories models may be registered from over the API (os.pathsep-separated).
+# Only native XGBoost files are accepted unless ADMIN_ALLOW_JOBLIB=1: joblib is a
+# pickle load, i.e. code execution for whoever can place the file.
+MODEL_DIRS = [d for d in os.environ.get("MODEL_DIRS", "saved_model").split(os.pathsep) if d]
+
+def allowed_model_file(path, native_only=False):
+    """Resolved `path` if it is a file under one of MODEL_DIRS, else a 400."""
+    resolved = os.path.realpath(path)
+    roots = [os.path.realpath(d) for d in MODEL_DIRS]
+    if not any(os.path.commonpath([resolved, root]) == root for root in roots):
+        raise HTTPException(status_code=400, detail=f"'{path}' is outside the model directories ({', '.join(MODEL_DIRS)}).")
+    if native_only and not resolved.endswith(NATIVE_FORMATS) and os.environ.get("ADMIN_ALLOW_JOBLIB") != "1":
+        raise HTTPException(status_code=400, detail=f"Only native XGBoost models ({', '.join(NATIVE_FORMATS)}) can be "
+                                                    "registered; export with `python model_registry.py export`.")
+    return resolved
+
+class RegisterModelInput(BaseModel):
+    name: str
+    model_path: str
+    columns_path: Optional[str] = None
+    activate: bool = False
+
+class RoutingInput(BaseModel):
+    weights: Dict[str, float]
+
+@app.get("/admin/models")
+def list_models(x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    return resources.get("model_registry").describe()
+
+@app.post("/admin/models")
+def register_model(model_input: RegisterModelInput, x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    model_path = allowed_model_file(model_input.model_path, native_only=True)
+    columns_path = allowed_model_file(model_input.columns_path) if model_input.columns_path else None
+    registry = resources.get("model_registry")
+    try:
+        registry.register(model_input.name, model_path, columns_path, model_input.activate)
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not load model: {e}")
+    registry.save_state()
+    return registry.describe()
+
+@app.post("/admin/models/reload")
+def reload_models(x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    registry = resources.get("model_registry")
+    return {"reloaded": registry.reload_changed(force=True), **registry.describe()}
+
+@app.post("/admin/models/{name}/activate")
+def activate_model(name: str, x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    registry = resources.get("model_registry")
+    try:
+        registry.activate(name)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown model version '{name}'.")
+    registry.save_state()
+    return registry.describe()
+
+@app.get("/debug/profiles")
+def outlier_profiles(x_admin_token: Optional[str] = Header(None)):
+    # Collapsed stacks (flamegraph.pl / speedscope input) of sampled slow requests
+    require_admin(x_admin_token)
+    return {"profiles": list(metrics.outlier_profiles)}
+
+@app.put("/admin/routing")
+def set_routing(routing_input: RoutingInput, x_admin_token: Optional[str] = Header(None)):
+    require_admin(x_admin_token)
+    registry = resources.get("model_registry")
+    try:
+        registry.set_routing(routing_input.weights)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Unknown model version(s): {e.args[0]}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    registry.save_state()
+    return registry.describe()
@@ -0,0 +1,97 @@
+# append_log.py
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+
+
+@contextmanager
+def exclusive_lock(f):
+    """Hold an exclusive advisory lock on the open file `f` (no-op without fcntl)."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield f
+    finally:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class Appender:
+    """Writes one batch to an AppendLog; see AppendLog.appending()."""
+
+    def __init__(self, data_file, record_bytes):
+        self._data = data_file
+        self._lines = []
+        self.row = data_file.tell() // record_bytes  # index of the next record
+
+    def write(self, record, line):
+        """Append one fixed-size record (or None for a line without one) and its log line."""
+        if record is not None:
+            self._data.write(record)
+            self.row += 1
+        self._lines.append(line if line.endswith("\n") else line + "\n")
+
+
+class AppendLog:
+    """
+    Append-only pair of files shared by several processes: fixed-size binary
+    records in `data_path` and one text line per record (or update) in `log_path`.
+
+    Records are always written before their log lines, so a crash can never leave
+    a line pointing at a missing record, and writers are serialized by an
+    exclusive lock on the log file. Readers follow the log with read_lines(),
+    which ignores a trailing partial line until it is complete.
+    """
+
+    def __init__(self, data_path, log_path, record_bytes):
+        self.data_path = data_path
+        self.log_path = log_path
+        self.record_bytes = record_bytes
+        self.offset = 0
+
+    def create(self):
+        for path in (self.data_path, self.log_path):
+            open(path, "ab").close()
+
+    def read_lines(self):
+        """Complete lines appended (by any process) since the last call."""
+        try:
+            if os.path.getsize(self.log_path) == self.offset:
+                return []
+            with open(self.log_path, "rb") as f:
+                f.seek(self.offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return []
+        # Ignore a trailing partial line; it is re-read once complete
+        end = chunk.rfind(b"\n") + 1
+        self.offset += end
+        return chunk[:end].splitlines()
+
+    def n_records(self):
+        try:
+            return os.path.getsize(self.data_path) // self.record_bytes
+        except FileNotFoundError:
+            return 0
+
+    @contextmanager
+    def appending(self):
+        """
+        Lock the log and yield an Appender positioned after the last whole record.
+        Records are flushed before the batch's lines are written, on a normal exit.
+        """
+        with open(self.data_path, "ab") as data_file, open(self.log_path, "ab") as log_file:
+            with exclusive_lock(log_file):
+                data_file.seek(0, os.SEEK_END)
+                # Re-align if a previous writer died mid-record
+                data_file.truncate(data_file.tell() // self.record_bytes * self.record_bytes)
+                data_file.seek(0, os.SEEK_END)
+                appender = Appender(data_file, self.record_bytes)
+                yield appender
+                data_file.flush()
+                log_file.write("".join(appender._lines).encode("utf-8"))
+                log_file.flush()
@@ -0,0 +1,89 @@
+# benchmarks/ann_recall.py
+#
+# Recall@k and per-query latency of the IVF similar-ads index against exact
+# brute-force cosine search, across nprobe values. By default the corpus is
+# synthetic clustered 384-d vectors; --csv indexes real ad embeddings instead.
+# Run from the repository root:
+#
+#     python -m benchmarks.ann_recall --rows 200000 --nprobe 1 4 8 16 32
+#     python -m benchmarks.ann_recall --csv data/advertising.csv
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex, build_index, history_from_csv, normalize_rows
+
+
+def synthetic_vectors(n_rows, dim, n_clusters, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    X = centers[rng.integers(0, n_clusters, n_rows)]
+    X += rng.normal(scale=0.8, size=X.shape).astype(np.float32)
+    return normalize_rows(X)
+
+
+def exact_top_k(X, Q, k):
+    scores = Q @ X.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return [set(row) for row in top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ANN index recall vs latency benchmark")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200, help="synthetic topic clusters")
+    parser.add_argument("--csv", help="index the distinct ads of this CSV instead of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    if args.csv:
+        from feature_engineering import embed_texts
+        texts, clicks, impressions = history_from_csv(args.csv)
+        X = normalize_rows(embed_texts(texts))
+    else:
+        X = synthetic_vectors(args.rows, args.dim, args.clusters)
+        texts = [f"ad {i}" for i in range(len(X))]
+        clicks, impressions = np.zeros(len(X)), np.ones(len(X))
+    # Queries are perturbed copies of indexed ads, like near-duplicate new copy
+    rng = np.random.default_rng(1)
+    Q = normalize_rows(X[rng.choice(len(X), args.queries)] + rng.normal(scale=0.05, size=(args.queries, X.shape[1])))
+
+    with tempfile.TemporaryDirectory() as root:
+        start = time.perf_counter()
+        build_index(root, texts, X, clicks, impressions, args.nlist)
+        build_s = time.perf_counter() - start
+        index = IVFIndex(root)
+        row_of_text = {t: i for i, t in enumerate(texts)}
+
+        start = time.perf_counter()
+        truth = exact_top_k(X, Q, args.k)
+        exact_ms = (time.perf_counter() - start) / args.queries * 1000
+        # Exact search one query at a time, as a request would run it
+        start = time.perf_counter()
+        for q in Q:
+            np.argpartition(-(X @ q), args.k - 1)[:args.k]
+        exact_single_ms = (time.perf_counter() - start) / args.queries * 1000
+
+        print(f"{len(X)} vectors x {X.shape[1]}d, {len(index.centroids)} lists, built in {build_s:.1f}s")
+        print(f"exact: {exact_single_ms:.3f} ms/query ({exact_ms:.3f} ms/query batched)")
+        print(f"{'nprobe':>7} {f'recall@{args.k}':>10} {'ms/query':>9} {'p99 ms':>8} {'speedup':>8}")
+        for nprobe in args.nprobe:
+            latencies, hits = [], 0
+            for q, expected in zip(Q, truth):
+                start = time.perf_counter()
+                found = index.search(q, k=args.k, nprobe=nprobe)[0]
+                latencies.append(time.perf_counter() - start)
+                hits += len(expected & {row_of_text[r["ad_text"]] for r in found})
+            ms = np.asarray(latencies) * 1000
+            print(f"{nprobe:>7} {hits / (args.k * args.queries):>10.3f} {ms.mean():>9.3f} "
+                  f"{np.percentile(ms, 99):>8.3f} {exact_single_ms / ms.mean():>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# benchmarks/embedding_batching.py
+#
+# Throughput/latency of single-text encode calls with micro-batching on and off.
+# Run from the repository root:
+#
+#     python -m benchmarks.embedding_batching --concurrency 1 4 16 64 --requests 512
+#
+# The embedding cache is bypassed so every call reaches the transformer.
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from embedding_service import BatchingEncoder
+from feature_engineering import get_embedding_model
+
+
+def run(encode, concurrency, n_requests):
+    texts = [f"Limited offer #{i}: upgrade your home office today" for i in range(n_requests)]
+    latencies = np.empty(n_requests)
+
+    def one(i):
+        start = time.perf_counter()
+        encode([texts[i]])
+        latencies[i] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(n_requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        "rps": n_requests / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding micro-batching benchmark")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    embedding_model = get_embedding_model()
+    batcher = BatchingEncoder(embedding_model.encode, args.max_batch_size, args.max_wait_ms).start()
+    # Warm both paths so neither pays first-call allocation costs
+    embedding_model.encode(["warmup"])
+    batcher.encode(["warmup"])
+
+    print(f"{'concurrency':>11} {'mode':>9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for concurrency in args.concurrency:
+        for mode, encode in (("direct", embedding_model.encode), ("batched", batcher.encode)):
+            r = run(encode, concurrency, args.requests)
+            print(f"{concurrency:>11} {mode:>9} {r['rps']:>9.1f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+    print(f"batcher: {batcher.stats()}")
+    batcher.stop()
+
+
+if __name__ == "__main__":
+    main()
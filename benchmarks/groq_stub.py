@@ -0,0 +1,80 @@
+# benchmarks/groq_stub.py
+#
+# Local stand-in for the Groq chat completions API, for offline testing and
+# benchmarking of the LLM layer:
+#
+#     STUB_LATENCY_MS=300 uvicorn benchmarks.groq_stub:app --port 8001
+#     GROQ_BASE_URL=http://127.0.0.1:8001 GROQ_API_KEY=stub uvicorn api:app
+#
+# STUB_FAIL_RATE injects HTTP 500s so error handling can be exercised too.
+#
+# StubAsyncGroq is an in-process equivalent for llm.set_client(), used by the
+# benchmark suite so it needs no network at all.
+import asyncio
+import os
+import random
+import time
+import uuid
+
+from types import SimpleNamespace
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+STUB_LATENCY_MS = float(os.environ.get("STUB_LATENCY_MS", "200"))
+STUB_FAIL_RATE = float(os.environ.get("STUB_FAIL_RATE", "0"))
+
+app = FastAPI(title="Groq stub")
+stats = {"requests": 0}
+
+
+def completion_payload(model, content):
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+def stub_reply(prompt):
+    if prompt.startswith("Rewrite"):
+        return "Discover our new collection, designed with your needs in mind."
+    return "Emphasize the product's concrete benefits instead of urgency."
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    await asyncio.sleep(STUB_LATENCY_MS / 1000.0)
+    if random.random() < STUB_FAIL_RATE:
+        return JSONResponse({"error": {"message": "stub failure", "type": "server_error"}}, status_code=500)
+    prompt = body["messages"][-1]["content"]
+    return completion_payload(body.get("model", "stub"), stub_reply(prompt))
+
+
+@app.get("/stats")
+def get_stats():
+    return stats
+
+
+class StubAsyncGroq:
+    """Minimal stand-in for groq.AsyncGroq: chat.completions.create() sleeps, then returns a canned reply."""
+
+    def __init__(self, latency_ms=STUB_LATENCY_MS):
+        self.latency = latency_ms / 1000.0
+        self.requests = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, messages, model, **kwargs):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        message = SimpleNamespace(role="assistant", content=stub_reply(messages[-1]["content"]))
+        return SimpleNamespace(choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")])
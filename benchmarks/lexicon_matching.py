@@ -0,0 +1,72 @@
+# benchmarks/lexicon_matching.py
+#
+# Per-ad cost of the keyword heuristics: the original per-phrase substring loop
+# versus the compiled single-pass automaton, at growing lexicon sizes.
+# Run from the repository root:
+#
+#     python -m benchmarks.lexicon_matching --sizes 10 1000 10000
+import argparse
+import random
+import time
+
+from lexicon import DEFAULT_LEXICONS, CompiledLexicon
+
+AD_TEXTS = [
+    "Hurry! Limited time offer based on your recent activity.",
+    "Discover our award-winning running shoes, built for comfort on long distances.",
+    "Doctors hate this miracle supplement - guaranteed cure for fatigue, today only!",
+    "Double your money with no risk. Financial freedom guaranteed for people like you.",
+    "Fresh, locally roasted coffee delivered to your door every week.",
+]
+
+WORDS = ("secure exclusive bonus instant free trial premium deal save cash growth "
+         "health detox boost profit wealth smart fast easy proven secret offer").split()
+
+
+def synthetic_lexicons(n_phrases, seed=0):
+    rng = random.Random(seed)
+    # Start from the real phrases (so the sample ads match something), then pad
+    defaults = [(c, p) for c, phrases in DEFAULT_LEXICONS.items() for p in sorted(phrases)]
+    lexicons = {category: set() for category in DEFAULT_LEXICONS}
+    for category, phrase in defaults[:n_phrases]:
+        lexicons[category].add(phrase)
+    categories = list(lexicons)
+    while sum(len(p) for p in lexicons.values()) < n_phrases:
+        phrase = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 4)))
+        lexicons[rng.choice(categories)].add(phrase)
+    return lexicons
+
+
+def naive_scan(text, lexicons):
+    text = text.lower()
+    return {category: sum(1 for keyword in keywords if keyword in text) for category, keywords in lexicons.items()}
+
+
+def time_per_call(fn, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        fn(AD_TEXTS[i % len(AD_TEXTS)])
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keyword heuristic matching benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'phrases':>8} {'compile ms':>11} {'loop us/ad':>11} {'automaton us/ad':>16} {'speedup':>8}")
+    for size in args.sizes:
+        lexicons = synthetic_lexicons(size)
+        start = time.perf_counter()
+        compiled = CompiledLexicon(lexicons)
+        compile_ms = (time.perf_counter() - start) * 1000
+        for text in AD_TEXTS:
+            assert compiled.scan(text)[0] == naive_scan(text, lexicons)
+        naive_us = time_per_call(lambda t: naive_scan(t, lexicons), args.repeat)
+        compiled_us = time_per_call(compiled.scan, args.repeat)
+        print(f"{len(compiled):>8} {compile_ms:>11.1f} {naive_us:>11.1f} {compiled_us:>16.1f} {naive_us / compiled_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
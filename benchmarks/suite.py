@@ -0,0 +1,222 @@
+# benchmarks/suite.py
+#
+# End-to-end latency/throughput benchmark for the prediction API, fully offline
+# (the Groq client is replaced by an in-process stub). Run from the repository root:
+#
+#     python -m benchmarks.suite --output bench.json
+#     python -m benchmarks.suite --output new.json --baseline bench.json --threshold 0.15
+#
+# 1. Per-stage timings of the /predict pipeline over the request corpus.
+# 2. An in-process load test of the FastAPI app at each --concurrency level,
+#    replaying the corpus round-robin.
+# With --baseline, every latency metric that got slower by more than --threshold
+# (and every throughput that dropped by more than it) is reported, and the exit
+# status is 1.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+
+os.environ.setdefault("WARMUP", "0")  # the suite warms up explicitly before measuring
+os.environ.setdefault("MODEL_WATCH_S", "0")
+
+import httpx
+import numpy as np
+import xgboost as xgb
+
+import api
+import llm
+import sweep
+from benchmarks.groq_stub import StubAsyncGroq
+from explain import breakdowns
+from feature_engineering import embed_texts, embedding_cache, get_embedding_model
+
+
+def load_corpus(path):
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    # Bare request bodies are /predict requests
+    return [e if "endpoint" in e else {"endpoint": "/predict", "body": e} for e in entries]
+
+
+def summarize(samples):
+    ms = np.asarray(samples) * 1000
+    return {
+        "mean_ms": round(float(ms.mean()), 4),
+        "p50_ms": round(float(np.percentile(ms, 50)), 4),
+        "p95_ms": round(float(np.percentile(ms, 95)), 4),
+        "p99_ms": round(float(np.percentile(ms, 99)), 4),
+        "n": len(ms),
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_stages(corpus, repeat):
+    """Time each stage of the single-ad pipeline, for every ad text in the corpus."""
+    version = api.resources.get("model_registry").active
+    embedding_model = get_embedding_model()
+    ads = []
+    for entry in corpus:
+        body = entry["body"]
+        for key in ("ad_text", "ad_text_a", "ad_text_b"):
+            if key in body:
+                ads.append({**body, "ad_text": body[key]})
+
+    stages = {name: [] for name in ("heuristics", "embedding", "embedding_cached", "feature_assembly",
+                                    "predict", "audience_insights", "explain", "llm_stubbed")}
+    for ad in ads:
+        text = ad["ad_text"]
+        targeting = (ad.get("target_age", 35), ad.get("area_income", 60000.0), ad.get("target_gender", "All"),
+                     ad.get("hour", 9), ad.get("day_of_week", 0))
+        row = api.build_feature_rows(version, [text], *targeting)
+
+        stages["heuristics"] += timed(lambda: api.lexicon_engine.scan(text), repeat)
+        stages["embedding"] += timed(lambda: embedding_model.encode([text]), repeat)
+        stages["embedding_cached"] += timed(lambda: embed_texts([text]), repeat)
+        stages["feature_assembly"] += timed(lambda: api.build_feature_rows(version, [text], *targeting), repeat)
+        stages["predict"] += timed(lambda: sweep.score_rows(version.booster, row), repeat)
+        stages["audience_insights"] += timed(
+            lambda: sweep.audience_insights(version.booster, row[0], version.plan.column_index), repeat)
+        stages["explain"] += timed(lambda: breakdowns(version.explainer, row), repeat)
+
+        result = api.score_ad(version, text, *targeting)
+
+        def llm_calls():
+            llm.completion_cache._entries.clear()  # measure the calls, not the prompt cache
+            asyncio.run(llm.run_calls(llm.ad_calls(result, text)))
+        stages["llm_stubbed"] += timed(llm_calls, max(1, repeat // 10))
+
+    return {name: summarize(samples) for name, samples in stages.items()}
+
+
+async def bench_load(corpus, concurrency, n_requests):
+    """Replay the corpus through the ASGI app with `concurrency` clients in flight."""
+    transport = httpx.ASGITransport(app=api.app)
+    latencies = []
+    errors = 0
+    counter = iter(range(n_requests))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                entry = corpus[i % len(corpus)]
+                start = time.perf_counter()
+                response = await client.post(entry["endpoint"], json=entry["body"])
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200 or "error" in response.json():
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {"concurrency": concurrency, "requests": n_requests, "errors": errors,
+            "throughput_rps": round(n_requests / elapsed, 2), **summarize(latencies)}
+
+
+async def run_load_tests(corpus, levels, n_requests):
+    results = {}
+    async with api.lifespan(api.app):
+        for concurrency in levels:
+            results[str(concurrency)] = await bench_load(corpus, concurrency, n_requests)
+            r = results[str(concurrency)]
+            print(f"  concurrency {concurrency:>3}: {r['throughput_rps']:>8.1f} req/s  "
+                  f"p50 {r['p50_ms']:.1f} ms  p95 {r['p95_ms']:.1f} ms  p99 {r['p99_ms']:.1f} ms  errors {r['errors']}")
+    return results
+
+
+def compare(current, baseline, threshold):
+    """List metrics that regressed by more than `threshold` (a fraction) against `baseline`."""
+    regressions = []
+
+    def check(label, new, old, higher_is_better=False):
+        if not old:
+            return
+        change = (old - new) / old if higher_is_better else (new - old) / old
+        if change > threshold:
+            regressions.append(f"{label}: {old:.3f} -> {new:.3f} ({change:+.1%})")
+
+    for stage, stats in current["stages"].items():
+        if stage in baseline.get("stages", {}):
+            check(f"stage {stage} p50_ms", stats["p50_ms"], baseline["stages"][stage]["p50_ms"])
+    for level, stats in current["load"].items():
+        old = baseline.get("load", {}).get(level)
+        if old:
+            check(f"load c={level} p99_ms", stats["p99_ms"], old["p99_ms"])
+            check(f"load c={level} throughput_rps", stats["throughput_rps"], old["throughput_rps"], higher_is_better=True)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prediction API benchmark suite")
+    parser.add_argument("--corpus", default="benchmarks/corpus.jsonl")
+    parser.add_argument("--repeat", type=int, default=50, help="timed repetitions per stage and ad")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    parser.add_argument("--llm-latency-ms", type=float, default=200.0, help="simulated Groq latency")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--baseline", help="earlier --output file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed relative regression")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    llm.set_client(StubAsyncGroq(latency_ms=args.llm_latency_ms))
+
+    print("Warming up...")
+    api.warmup()
+    if not api.startup_report["ready"]:
+        sys.exit(f"Warmup failed: {api.startup_report['error']}")
+
+    print("Timing pipeline stages...")
+    stages = bench_stages(corpus, args.repeat)
+    for name, stats in stages.items():
+        print(f"  {name:<18} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms  p99 {stats['p99_ms']:>9.3f} ms")
+
+    print("Load testing the API in-process...")
+    load = asyncio.run(run_load_tests(corpus, args.concurrency, args.requests))
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "xgboost": xgb.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "corpus": args.corpus,
+            "llm_latency_ms": args.llm_latency_ms,
+            "model_version": api.resources.get("model_registry").active.name,
+            "embedding_cache": embedding_cache.stats(),
+        },
+        "startup": api.startup_report,
+        "stages": stages,
+        "load": load,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"Regressions beyond {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# bulk_score.py
+#
+# Offline bulk scoring of ad variants with the saved model.
+#
+#     python bulk_score.py ads.csv scores/ --format parquet --workers 4 --chunk-size 20000
+#
+# Input may be CSV, JSONL or Parquet, with either API field names (ad_text,
+# target_age, area_income, target_gender, hour, day_of_week) or training column
+# names ('Ad Topic Line', 'Age', 'Area Income', 'Male', 'Hour', 'DayOfWeek').
+# Missing targeting columns take the same defaults as the API.
+#
+# Input is streamed in chunks; each chunk is scored by a worker process and written
+# to its own part file in the output directory. Completed chunks are recorded in
+# _checkpoint.json, so re-running the same command after a crash resumes where
+# it stopped.
+import argparse
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from dim_reduction import load_reducer
+from feature_engineering import create_features, embedding_cache
+from lexicon import LexiconEngine
+from model_registry import default_model_path, load_booster
+import sweep
+
+CHECKPOINT_FILE = "_checkpoint.json"
+
+# API request field -> training column, with the API's default value
+API_FIELDS = {
+    'ad_text': ('Ad Topic Line', None),
+    'target_age': ('Age', 35),
+    'area_income': ('Area Income', 60000.0),
+    'target_gender': ('Male', 0),  # "Male" -> 1, anything else -> 0
+    'hour': ('Hour', 9),
+    'day_of_week': ('DayOfWeek', 0),
+}
+
+RISK_COLUMNS = {
+    'privacy': 'creepiness_score',
+    'urgency': 'urgency_score',
+    'medical': 'medical_claims_score',
+    'financial': 'financial_promises_score',
+}
+
+
+def iter_chunks(path, chunk_size):
+    """Yield DataFrames of at most `chunk_size` rows from a CSV, JSONL or Parquet file."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        yield from pd.read_csv(path, chunksize=chunk_size)
+    elif ext in (".jsonl", ".ndjson"):
+        yield from pd.read_json(path, lines=True, chunksize=chunk_size)
+    elif ext == ".parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported input format '{ext}'. Use .csv, .jsonl or .parquet.")
+
+
+def to_model_inputs(chunk):
+    """Map a raw input chunk to the columns create_features expects, applying API defaults."""
+    df = pd.DataFrame(index=chunk.index)
+    for field, (column, default) in API_FIELDS.items():
+        if column in chunk.columns:
+            df[column] = chunk[column]
+        elif field in chunk.columns:
+            values = chunk[field]
+            df[column] = (values == "Male").astype(int) if field == 'target_gender' else values
+        elif default is None:
+            raise ValueError(f"Input has neither '{field}' nor '{column}' column.")
+        else:
+            df[column] = default
+    df['Ad Topic Line'] = df['Ad Topic Line'].fillna('').astype(str)
+    return df.reset_index(drop=True)
+
+
+# Per-worker state, set up once by _init_worker
+_worker = {}
+
+
+def _init_worker(model_path, columns_path, threads, disk_cache):
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    # Hits in the shared disk cache are used either way; adding a large one-off
+    # batch of texts to it (and so to every API worker's store) is opt-in
+    embedding_cache.disk_writes = disk_cache
+    _worker['model'] = load_booster(model_path)
+    with open(columns_path, 'r') as f:
+        _worker['model_columns'] = json.load(f)
+    _worker['reducer'] = load_reducer(columns_path)
+    _worker['lexicon'] = LexiconEngine(os.environ.get("LEXICON_DIR") or None)
+
+
+def score_chunk(chunk_id, chunk, output_dir, fmt, id_column):
+    """Score one chunk and write it atomically to its part file. Returns (chunk_id, rows, seconds)."""
+    start = time.perf_counter()
+    inputs = to_model_inputs(chunk)
+    features = create_features(inputs.copy(), is_training=False, reducer=_worker['reducer'])[_worker['model_columns']]
+    # Same float32 rows and booster call as the API's scoring path
+    probs = sweep.score_rows(_worker['model'], features.to_numpy(dtype=np.float32))
+
+    out = pd.DataFrame()
+    if id_column:
+        out[id_column] = chunk[id_column].values
+    out['ad_text'] = inputs['Ad Topic Line'].values
+    out['click_probability'] = probs.astype(np.float64)
+    out['predicted_performance_score'] = [round(float(p * 100), 2) for p in probs]
+    counts = [_worker['lexicon'].scan(text)[0] for text in inputs['Ad Topic Line']]
+    for category, column in RISK_COLUMNS.items():
+        out[column] = [c.get(category, 0) for c in counts]
+
+    path = os.path.join(output_dir, f"part-{chunk_id:06d}.{fmt}")
+    tmp_path = path + ".tmp"
+    if fmt == "parquet":
+        out.to_parquet(tmp_path, index=False)
+    else:
+        out.to_json(tmp_path, orient="records", lines=True, force_ascii=False)
+    os.replace(tmp_path, path)
+    return chunk_id, len(out), time.perf_counter() - start
+
+
+def load_checkpoint(output_dir, settings):
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    if not os.path.exists(path):
+        return {**settings, "completed": [], "rows": 0}
+    with open(path) as f:
+        checkpoint = json.load(f)
+    for key, value in settings.items():
+        if checkpoint.get(key) != value:
+            raise SystemExit(f"{output_dir} holds a run with {key}={checkpoint.get(key)!r}, not {value!r}. "
+                             "Use a new output directory.")
+    return checkpoint
+
+
+def save_checkpoint(output_dir, checkpoint):
+    path = os.path.join(output_dir, CHECKPOINT_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-score ads with the saved model.")
+    parser.add_argument("input", help="CSV, JSONL or Parquet file of ads")
+    parser.add_argument("output_dir", help="directory for part files and the checkpoint")
+    parser.add_argument("--format", choices=["parquet", "jsonl"], default="parquet")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--id-column", help="input column copied to the output to join results back")
+    parser.add_argument("--model", default=None,
+                        help="model file (default: the one the API serves, native format first)")
+    parser.add_argument("--columns", default="saved_model/model_columns.json")
+    parser.add_argument("--disk-cache", action="store_true",
+                        help="also add new embeddings to the persistent embedding cache (read either way)")
+    args = parser.parse_args()
+
+    args.model = args.model or default_model_path()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    # A resumed run must score its remaining chunks with the same model file, unchanged
+    settings = {"input": os.path.abspath(args.input), "chunk_size": args.chunk_size, "format": args.format,
+                "model": os.path.abspath(args.model), "model_mtime_ns": os.stat(args.model).st_mtime_ns}
+    checkpoint = load_checkpoint(args.output_dir, settings)
+    completed = set(checkpoint["completed"])
+    if completed:
+        print(f"Resuming: {len(completed)} chunks ({checkpoint['rows']} rows) already scored.")
+
+    init_args = (args.model, args.columns, args.threads_per_worker, args.disk_cache)
+    start = time.perf_counter()
+    new_rows = 0
+
+    def record(result):
+        nonlocal new_rows
+        chunk_id, rows, seconds = result
+        completed.add(chunk_id)
+        checkpoint["completed"] = sorted(completed)
+        checkpoint["rows"] += rows
+        new_rows += rows
+        save_checkpoint(args.output_dir, checkpoint)
+        print(f"Chunk {chunk_id}: {rows} rows in {seconds:.1f}s")
+
+    chunks = ((i, chunk) for i, chunk in enumerate(iter_chunks(args.input, args.chunk_size)) if i not in completed)
+    if args.workers <= 1:
+        _init_worker(*init_args)
+        for chunk_id, chunk in chunks:
+            record(score_chunk(chunk_id, chunk, args.output_dir, args.format, args.id_column))
+    else:
+        with ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=init_args) as pool:
+            # Bound the chunks in flight so memory stays flat however large the input is
+            pending = set()
+            for chunk_id, chunk in chunks:
+                pending.add(pool.submit(score_chunk, chunk_id, chunk, args.output_dir, args.format, args.id_column))
+                if len(pending) >= 2 * args.workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        record(future.result())
+            for future in pending:
+                record(future.result())
+
+    elapsed = time.perf_counter() - start
+    print(f"Scored {new_rows} rows in {elapsed:.1f}s ({new_rows / max(elapsed, 1e-9):.0f} rows/s); "
+          f"{checkpoint['rows']} rows total in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,15 @@
-import joblib
-import xgboost as xgb
 import json
 
-model = joblib.load('saved_model/model.joblib')
+from model_registry import default_model_path, load_booster
+
+# The model the API serves: a native export (e.g. from streaming training) or model.joblib
+model = load_booster(default_model_path())
 with open('saved_model/model_columns.json', 'r') as f:
     model_columns = json.load(f)
 
-# Print feature importances
-importance = model.feature_importances_
+# Print feature importances (average gain, normalized: XGBClassifier.feature_importances_)
+gain = model.get_score(importance_type='gain')
+total = sum(gain.values()) or 1.0
 for i, col in enumerate(model_columns):
     if col in ['Hour', 'DayOfWeek', 'Age', 'Area Income']:
-        print(f"{col}: {importance[i]}")
+        print(f"{col}: {gain.get(col, gain.get(f'f{i}', 0.0)) / total}")
@@ -0,0 +1,57 @@
+# check_parity.py
+# Consistency checks between the fast serving paths and the reference implementations.
+# Run from the repository root: python check_parity.py
+import json
+import numpy as np
+import pandas as pd
+from dim_reduction import load_reducer
+from explain import make_explainer, SHAP_GROUPS
+from feature_engineering import create_features, embed_texts
+from feature_plan import FeaturePlan
+from model_registry import default_model_path, load_booster
+
+# The model the API serves (native export first, e.g. after streaming training)
+model = load_booster(default_model_path())
+with open('saved_model/model_columns.json', 'r') as f:
+    model_columns = json.load(f)
+# Embedding reducer saved by train_model.py --reduction, if any
+reducer = load_reducer('saved_model/model_columns.json')
+
+# Sample of real ads through the training feature path
+df = pd.read_csv('data/advertising.csv').sample(50, random_state=0)
+X = create_features(df, is_training=False, reducer=reducer)[model_columns].to_numpy(dtype=np.float32)
+
+# 1. Native XGBoost contributions vs shap.TreeExplainer
+reference = make_explainer(model, model_columns, backend="shap")
+native = make_explainer(model, model_columns, backend="native")
+per_feature_diff = np.abs(native.contributions(X) - reference.contributions(X)).max()
+grouped_diff = np.abs(native.group_contributions(X) - reference.group_contributions(X)).max()
+print(f"Explainer parity: max per-feature diff {per_feature_diff:.2e}, max group diff {grouped_diff:.2e} over {len(X)} rows")
+assert grouped_diff < 1e-3, f"native explainer disagrees with shap backend on groups {SHAP_GROUPS}"
+
+# Approximate contributions are not expected to match; report how far off they are
+approx = make_explainer(model, model_columns, backend="native_approx")
+approx_diff = np.abs(approx.group_contributions(X) - reference.group_contributions(X)).max()
+print(f"Approximate contributions: max group diff {approx_diff:.2e} (informational)")
+
+# 2. Preallocated feature plan vs the pandas create_features path, on API-style inputs
+inputs = pd.DataFrame({
+    'Ad Topic Line': df['Ad Topic Line'].values,
+    'Age': df['Age'].values,
+    'Area Income': df['Area Income'].values,
+    'Male': df['Male'].values,
+    'Hour': pd.to_datetime(df['Timestamp']).dt.hour.values,
+    'DayOfWeek': pd.to_datetime(df['Timestamp']).dt.dayofweek.values,
+})
+inputs.loc[0, 'Area Income'] = np.nan  # exercise the missing-value fill
+pandas_rows = create_features(inputs.copy(), is_training=False, reducer=reducer)[model_columns].to_numpy(dtype=np.float32)
+records = inputs.drop(columns=['Ad Topic Line']).to_dict('records')
+embeddings = embed_texts(inputs['Ad Topic Line'].tolist())
+if reducer is not None:
+    embeddings = reducer.transform(embeddings)
+plan_rows = FeaturePlan(model_columns).assemble(records, embeddings)
+assert plan_rows.dtype == pandas_rows.dtype and plan_rows.shape == pandas_rows.shape
+assert plan_rows.tobytes() == pandas_rows.tobytes(), "feature plan output differs from create_features"
+print(f"Feature plan parity: byte-identical over {len(records)} rows")
+
+print("All parity checks passed.")
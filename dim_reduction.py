@@ -0,0 +1,72 @@
+# dim_reduction.py
+import os
+
+import numpy as np
+
+REDUCTION_KINDS = ("pca", "random")
+
+
+class EmbeddingReducer:
+    """
+    Linear map from sentence embeddings to the model's `emb_*` columns:
+    (embeddings - mean) @ components, in float32. Fitted once at training time and
+    saved next to model_columns.json, so serving applies exactly the same transform.
+    """
+
+    def __init__(self, kind, components, mean):
+        self.kind = kind
+        self.components = np.ascontiguousarray(components, dtype=np.float32)  # (input dim, output dim)
+        self.mean = np.asarray(mean, dtype=np.float32)
+
+    @property
+    def input_dim(self):
+        return self.components.shape[0]
+
+    @property
+    def output_dim(self):
+        return self.components.shape[1]
+
+    def transform(self, embeddings):
+        return (np.asarray(embeddings, dtype=np.float32) - self.mean) @ self.components
+
+    def save(self, path):
+        np.savez(path, kind=self.kind, components=self.components, mean=self.mean)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(str(data["kind"]), data["components"], data["mean"])
+
+
+def fit_pca(embeddings, n_components):
+    """Top principal directions of `embeddings` (rows are samples)."""
+    X = np.asarray(embeddings, dtype=np.float64)
+    mean = X.mean(axis=0)
+    _, _, vt = np.linalg.svd(X - mean, full_matrices=False)
+    return EmbeddingReducer("pca", vt[:n_components].T, mean)
+
+
+def fit_random_projection(input_dim, n_components, seed=42):
+    """Gaussian random projection; needs no data and roughly preserves distances."""
+    rng = np.random.default_rng(seed)
+    components = rng.normal(scale=1.0 / np.sqrt(n_components), size=(input_dim, n_components))
+    return EmbeddingReducer("random", components, np.zeros(input_dim))
+
+
+def fit_reducer(kind, embeddings, n_components):
+    if kind == "pca":
+        return fit_pca(embeddings, n_components)
+    if kind == "random":
+        return fit_random_projection(np.asarray(embeddings).shape[1], n_components)
+    raise ValueError(f"Unknown reduction '{kind}'. Use one of: {', '.join(REDUCTION_KINDS)}.")
+
+
+def reducer_path(columns_path):
+    """Where the reducer for a model_columns file lives: model_columns.json -> model_columns.reducer.npz."""
+    return os.path.splitext(columns_path)[0] + ".reducer.npz"
+
+
+def load_reducer(columns_path):
+    """The reducer saved with `columns_path`, or None for models trained on raw embeddings."""
+    path = reducer_path(columns_path) if columns_path else None
+    return EmbeddingReducer.load(path) if path and os.path.exists(path) else None
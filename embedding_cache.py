@@ -0,0 +1,349 @@
+# embedding_cache.py
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from append_log import AppendLog, exclusive_lock
+
+
+def normalize_text(text):
+    """Canonical form of an ad text used for cache keys (NFC, collapsed whitespace)."""
+    text = unicodedata.normalize("NFC", str(text))
+    return " ".join(text.split())
+
+
+def cache_key(text, model_name):
+    """Content address of an embedding: hash of the embedding model name and normalized text."""
+    payload = f"{model_name}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+class _SealedSegment:
+    """
+    Immutable part of the disk store, entirely memory-mapped: vectors sorted by
+    key, and the 16-byte keys, searched by their first 8 bytes with binary search.
+    """
+
+    def __init__(self, base):
+        self.vectors = np.load(base + ".vec.npy", mmap_mode="r")
+        self.keys = np.load(base + ".keys.npy", mmap_mode="r")  # (n, 16) uint8, sorted by prefix
+        self.prefixes = self.keys.view("<u8")[:, 0]
+        self.nbytes = os.path.getsize(base + ".vec.npy") + os.path.getsize(base + ".keys.npy")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, key_bytes):
+        prefix = np.frombuffer(key_bytes[:8], dtype="<u8")[0]
+        lo = int(np.searchsorted(self.prefixes, prefix, side="left"))
+        hi = int(np.searchsorted(self.prefixes, prefix, side="right"))
+        for row in range(lo, hi):
+            if bytes(self.keys[row]) == key_bytes:
+                return self.vectors[row]
+        return None
+
+    @staticmethod
+    def write(base, keys, vectors):
+        keys = np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(-1, 16)
+        order = np.argsort(keys.view("<u8")[:, 0], kind="stable")
+        for suffix, array in ((".keys.npy", keys[order]), (".vec.npy", np.asarray(vectors)[order])):
+            np.save(base + suffix + ".tmp.npy", array)
+            os.replace(base + suffix + ".tmp.npy", base + suffix)
+
+
+class DiskEmbeddingStore:
+    """
+    Persistent embedding store with a disk budget, shared by all processes.
+
+    A directory per embedding model and dtype holds:
+      MANIFEST                 the sealed segment ids (oldest first) and the active id
+      active-<id>.vec/.keys    the append-only active segment: raw row-major vectors,
+                               and one "<key> <row>" line per stored vector
+      seg-<id>.vec.npy/.keys.npy  sealed segments, written when the active segment
+                               reaches `segment_rows` vectors
+
+    Only the active segment has an in-memory index (at most `segment_rows`
+    entries, loaded on first use); sealed segments are memory-mapped and searched
+    in place, newest first. When the directory exceeds `max_bytes` the oldest
+    sealed segments are deleted, so the store is a FIFO-evicting cache.
+
+    The vector is always written before its key line, so a crash can never leave
+    a key pointing at a missing row. Writes (appends, sealing and eviction) are
+    serialized with an exclusive file lock.
+    """
+
+    def __init__(self, directory, model_name, dim, dtype="float32", max_bytes=None, segment_rows=65536):
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.row_bytes = dim * self.dtype.itemsize
+        self.max_bytes = max_bytes
+        if max_bytes:
+            # Several segments fit in the budget, so eviction drops a fraction of it at a time
+            segment_rows = max(256, min(segment_rows, max_bytes // (4 * self.row_bytes)))
+        self.segment_rows = segment_rows
+        safe_name = model_name.replace("/", "__")
+        self.directory = os.path.join(directory, f"{safe_name}.{self.dtype.name}")
+        os.makedirs(self.directory, exist_ok=True)
+        self.manifest_path = os.path.join(self.directory, "MANIFEST")
+        self.lock_path = os.path.join(self.directory, "LOCK")
+
+        self._manifest_mtime = None
+        self._sealed = []  # (id, _SealedSegment), newest first
+        self._active_id = None
+        self._index = {}  # active segment: key bytes -> row
+        self._log = None  # active segment's AppendLog
+        self._mmap = None
+        self._mapped_rows = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        self.refresh()
+        return len(self._index) + sum(len(segment) for _, segment in self._sealed)
+
+    def _base(self, kind, segment_id):
+        return os.path.join(self.directory, f"{kind}-{segment_id}")
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"sealed": [], "active": 0}
+
+    def _write_manifest(self, manifest):
+        tmp = self.manifest_path + f".{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self.manifest_path)
+
+    def refresh(self):
+        """Pick up sealing, eviction and rows appended by other processes since the last refresh."""
+        with self._lock:
+            self._refresh()
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self._manifest_mtime or self._active_id is None:
+            manifest = self._read_manifest()
+            self._manifest_mtime = mtime
+            opened = dict(self._sealed)
+            sealed = []
+            for segment_id in reversed(manifest["sealed"]):
+                segment = opened.get(segment_id)
+                if segment is None:
+                    try:
+                        segment = _SealedSegment(self._base("seg", segment_id))
+                    except FileNotFoundError:
+                        continue  # evicted while we were reading the manifest
+                sealed.append((segment_id, segment))
+            self._sealed = sealed
+            if manifest["active"] != self._active_id:
+                self._active_id = manifest["active"]
+                base = self._base("active", self._active_id)
+                self._log = AppendLog(base + ".vec", base + ".keys", self.row_bytes)
+                self._index = {}
+                self._mmap = None
+                self._mapped_rows = 0
+        for line in self._log.read_lines():
+            parts = line.split()
+            if len(parts) == 2:
+                self._index[bytes.fromhex(parts[0].decode("ascii"))] = int(parts[1])
+
+    def _active_row(self, row):
+        if row >= self._mapped_rows:
+            # 0 once sealed by another process: found in the sealed segment after a refresh
+            n_rows = self._log.n_records()
+            if row >= n_rows:
+                return None
+            self._mmap = np.memmap(self._log.data_path, dtype=self.dtype, mode="r", shape=(n_rows, self.dim))
+            self._mapped_rows = n_rows
+        return self._mmap[row]
+
+    def _find(self, key_bytes):
+        row = self._index.get(key_bytes)
+        if row is not None:
+            return self._active_row(row)
+        for _, segment in self._sealed:
+            vector = segment.find(key_bytes)
+            if vector is not None:
+                return vector
+        return None
+
+    def get(self, key):
+        key_bytes = bytes.fromhex(key)
+        with self._lock:
+            if self._active_id is None:
+                self._refresh()
+            vector = self._find(key_bytes)
+            if vector is None:
+                self._refresh()
+                vector = self._find(key_bytes)
+            return None if vector is None else np.asarray(vector, dtype=np.float32)
+
+    def put_many(self, items):
+        """Append (key, vector) pairs that are not yet on disk, sealing and evicting as needed."""
+        with self._lock, open(self.lock_path, "ab") as lock_file, exclusive_lock(lock_file):
+            self._refresh()  # state left by other writers comes first
+            items = [(bytes.fromhex(key), vector) for key, vector in items]
+            while items:
+                room = max(self.segment_rows - len(self._index), 0)
+                self._append(items[:room])
+                items = items[room:]
+                if len(self._index) >= self.segment_rows:
+                    self._seal()
+
+    def _append(self, items):
+        with self._log.appending() as appender:
+            for key_bytes, vector in items:
+                if key_bytes in self._index or self._find(key_bytes) is not None:
+                    continue
+                self._index[key_bytes] = row = appender.row
+                appender.write(np.asarray(vector, dtype=self.dtype).tobytes(), f"{key_bytes.hex()} {row}")
+
+    def _seal(self):
+        # Called with the file lock held: freeze the active segment, start a new one, evict
+        manifest = self._read_manifest()
+        keys = list(self._index)
+        # Rows of a writer that died before logging its keys are skipped here
+        stored = np.fromfile(self._log.data_path, dtype=self.dtype).reshape(-1, self.dim)
+        _SealedSegment.write(self._base("seg", self._active_id), keys, stored[[self._index[k] for k in keys]])
+        manifest = {"sealed": manifest["sealed"] + [self._active_id], "active": self._active_id + 1}
+        evicted = []
+        if self.max_bytes:
+            sizes = {sid: _SealedSegment(self._base("seg", sid)).nbytes for sid in manifest["sealed"]}
+            # Leave room for the new active segment to fill up
+            budget = self.max_bytes - self.segment_rows * self.row_bytes
+            while len(manifest["sealed"]) > 1 and sum(sizes[s] for s in manifest["sealed"]) > budget:
+                evicted.append(manifest["sealed"].pop(0))
+        self._write_manifest(manifest)
+        # Readers that still map removed files keep them valid until they refresh
+        for path in (self._log.data_path, self._log.log_path):
+            os.remove(path)
+        for segment_id in evicted:
+            for suffix in (".vec.npy", ".keys.npy"):
+                os.remove(self._base("seg", segment_id) + suffix)
+        self._refresh()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache: an in-process LRU bounded by a byte budget,
+    optionally backed by a persistent DiskEmbeddingStore.
+
+    Lookups go memory -> disk -> encoder; anything encoded is written to both tiers
+    (to memory only while `disk_writes` is False, e.g. for one-off bulk jobs).
+    With `dtype="float16"` both tiers hold half-size vectors. Fresh encodes are
+    rounded to that precision as well, so a text embeds identically whether it
+    was a hit or a miss.
+    """
+
+    def __init__(self, model_name, dim, max_bytes=64 * 1024 * 1024, disk_dir=None, dtype="float32",
+                 disk_max_bytes=None):
+        self.model_name = model_name
+        self.dim = dim
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.disk = DiskEmbeddingStore(disk_dir, model_name, dim, dtype, disk_max_bytes) if disk_dir else None
+        self.disk_writes = True
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get_memory(self, key):
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return vector
+
+    def _put_memory(self, key, vector):
+        with self._lock:
+            if key in self._entries or vector.nbytes > self.max_bytes:
+                return
+            self._entries[key] = vector
+            self._bytes += vector.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def _lookup(self, key):
+        vector = self._get_memory(key)
+        if vector is None and self.disk is not None:
+            vector = self.disk.get(key)
+            if vector is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._put_memory(key, vector.astype(self.dtype))
+        return vector
+
+    def get(self, text):
+        return self._lookup(cache_key(text, self.model_name))
+
+    def encode(self, texts, encode_fn):
+        """
+        Return a float32 (len(texts), dim) array of embeddings for `texts`.
+        Only texts missing from both cache tiers are passed to `encode_fn`,
+        each distinct normalized text at most once.
+        """
+        texts = list(texts)
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        pending = OrderedDict()  # key -> (text, [output rows])
+        for i, text in enumerate(texts):
+            key = cache_key(text, self.model_name)
+            if key in pending:
+                pending[key][1].append(i)
+                continue
+            vector = self._lookup(key)
+            if vector is None:
+                pending[key] = (text, [i])
+            else:
+                out[i] = vector
+
+        if pending:
+            with self._lock:
+                self.misses += len(pending)
+            encoded = np.asarray(encode_fn([text for text, _ in pending.values()]), dtype=np.float32)
+            new_items = []
+            for (key, (_, rows)), vector in zip(pending.items(), encoded):
+                vector = np.ascontiguousarray(vector, dtype=self.dtype)
+                out[rows] = vector
+                self._put_memory(key, vector)
+                new_items.append((key, vector))
+            if self.disk is not None and self.disk_writes:
+                self.disk.put_many(new_items)
+        return out
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "model_name": self.model_name,
+                "dtype": self.dtype.name,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "disk_entries": len(self.disk) if self.disk is not None else None,
+            }
@@ -0,0 +1,124 @@
+# embedding_service.py
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class BatchingEncoder:
+    """
+    Dynamic micro-batching front end for a batch encoder such as SentenceTransformer.encode.
+
+    Concurrent callers submit texts; a single worker thread drains the queue into
+    batches of at most `max_batch_size` texts, waiting at most `max_wait_ms` after
+    the first queued text for more to arrive (only when recent traffic has been
+    concurrent, so a lone request is never delayed), runs one encode call per
+    batch and resolves each caller's Future with its own vector.
+    """
+
+    def __init__(self, encode_fn, max_batch_size=32, max_wait_ms=5.0):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self._last_batch_size = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def submit(self, texts):
+        """Queue texts for encoding and return one Future per text."""
+        futures = []
+        for text in texts:
+            future = Future()
+            self._queue.put((text, future))
+            futures.append(future)
+        return futures
+
+    def encode(self, texts):
+        """Blocking, drop-in replacement for encode_fn(texts)."""
+        if not self.running:
+            return self.encode_fn(list(texts))
+        futures = self.submit(texts)
+        return np.stack([f.result() for f in futures]) if futures else np.empty((0, 0), dtype=np.float32)
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self.queue_depth(),
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                # Only hold the batch open once there is evidence of concurrency
+                remaining = deadline - time.monotonic()
+                if (len(batch) == 1 and self._last_batch_size <= 1) or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                # Finish the current batch, then let the loop see the stop signal
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            # Skip callers that gave up (cancelled futures) before encoding
+            batch = [(text, f) for text, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                vectors = self.encode_fn([text for text, _ in batch])
+            except Exception as e:
+                for _, f in batch:
+                    f.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(batch)
+            self._last_batch_size = len(batch)
+            for (_, f), vector in zip(batch, vectors):
+                f.set_result(vector)
@@ -0,0 +1,88 @@
+# explain.py
+import os
+
+import numpy as np
+import xgboost as xgb
+
+# Feature groups reported in `shap_breakdown`, in response order
+SHAP_GROUPS = ["Ad Copy Text", "Target Age", "Area Income", "Target Gender", "Schedule (Time & Day)"]
+
+
+def feature_group(col):
+    if col.startswith('emb_'):
+        return "Ad Copy Text"
+    if col == 'Age':
+        return "Target Age"
+    if col == 'Area Income':
+        return "Area Income"
+    if col == 'Male':
+        return "Target Gender"
+    if col in ['Hour', 'DayOfWeek']:
+        return "Schedule (Time & Day)"
+    return None
+
+
+def group_matrix(model_columns):
+    """(n_features, n_groups) 0/1 matrix folding per-feature contributions into SHAP_GROUPS."""
+    G = np.zeros((len(model_columns), len(SHAP_GROUPS)))
+    for i, col in enumerate(model_columns):
+        group = feature_group(col)
+        if group is not None:
+            G[i, SHAP_GROUPS.index(group)] = 1.0
+    return G
+
+
+class NativeExplainer:
+    """
+    Per-feature contributions from XGBoost's own `pred_contribs` (exact TreeSHAP,
+    or Saabas-style approximations with `approx=True`). Needs no `shap` import.
+    """
+
+    def __init__(self, model, model_columns, approx=False):
+        self.booster = model.get_booster() if hasattr(model, "get_booster") else model
+        self.model_columns = list(model_columns)
+        self.approx = approx
+        self.groups = group_matrix(self.model_columns)
+
+    def contributions(self, X):
+        dmatrix = xgb.DMatrix(X, feature_names=self.model_columns)
+        contribs = self.booster.predict(dmatrix, pred_contribs=True, approx_contribs=self.approx)
+        return contribs[:, :-1]  # drop the bias column
+
+    def group_contributions(self, X):
+        return self.contributions(X) @ self.groups
+
+
+class ShapExplainer:
+    """The original `shap.TreeExplainer` backend, kept for parity checks."""
+
+    def __init__(self, model, model_columns):
+        import shap
+        self.explainer = shap.TreeExplainer(model)
+        self.model_columns = list(model_columns)
+        self.groups = group_matrix(self.model_columns)
+
+    def contributions(self, X):
+        shap_values = self.explainer.shap_values(X)
+        return np.asarray(shap_values[0] if isinstance(shap_values, list) else shap_values)
+
+    def group_contributions(self, X):
+        return self.contributions(X) @ self.groups
+
+
+def make_explainer(model, model_columns, backend=None):
+    """Build the explainer selected by `backend` or EXPLAINER_BACKEND: native (default), native_approx or shap."""
+    backend = backend or os.environ.get("EXPLAINER_BACKEND", "native")
+    if backend == "native":
+        return NativeExplainer(model, model_columns)
+    if backend == "native_approx":
+        return NativeExplainer(model, model_columns, approx=True)
+    if backend == "shap":
+        return ShapExplainer(model, model_columns)
+    raise ValueError(f"Unknown explainer backend '{backend}'. Use native, native_approx or shap.")
+
+
+def breakdowns(explainer, X):
+    """`shap_breakdown` dicts for each row of the float32 matrix X, from one batched explain call."""
+    grouped = explainer.group_contributions(X)
+    return [{group: round(float(v), 2) for group, v in zip(SHAP_GROUPS, row)} for row in grouped]
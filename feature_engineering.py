@@ -1,22 +1,71 @@
 # feature_engineering.py
+import os
 import pandas as pd
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from embedding_cache import EmbeddingCache
+from embedding_service import BatchingEncoder
+from resources import resources
 
-# Load the NLP Embedding Model (Downloads ~80MB on first run)
-# This model converts text into a 384-dimensional mathematical vector
-print("Loading NLP Embedding Model (sentence-transformers)...")
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-print("Model loaded successfully!")
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_DIM = 384
 
-def create_features(df, is_training=False):
+# Tabular model inputs, in the order create_features emits them
+TABULAR_FEATURES = ['Age', 'Area Income', 'Male', 'Hour', 'DayOfWeek']
+
+def _load_embedding_model():
+    # Load the NLP Embedding Model (Downloads ~80MB on first run)
+    # This model converts text into a 384-dimensional mathematical vector
+    from sentence_transformers import SentenceTransformer
+    print("Loading NLP Embedding Model (sentence-transformers)...")
+    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    print("Model loaded successfully!")
+    return model
+
+# Loaded on first use, so importing this module stays cheap for tools that never embed
+resources.register("embedding_model", _load_embedding_model)
+
+def get_embedding_model():
+    return resources.get("embedding_model")
+
+def _encode_batch(texts):
+    return get_embedding_model().encode(texts)
+
+# Content-addressed embedding cache shared by api.py and train_model.py.
+# EMBEDDING_CACHE_MB bounds the in-process LRU; EMBEDDING_CACHE_DIR holds the
+# persistent memory-mapped store (set it to an empty string to disable it), whose
+# size EMBEDDING_CACHE_DISK_MB bounds by evicting its oldest segments.
+# EMBEDDING_CACHE_DTYPE=float16 halves both tiers at a small precision cost.
+embedding_cache = EmbeddingCache(
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_DIM,
+    max_bytes=int(float(os.environ.get("EMBEDDING_CACHE_MB", "64")) * 1024 * 1024),
+    disk_dir=os.environ.get("EMBEDDING_CACHE_DIR", ".cache/embeddings") or None,
+    dtype=os.environ.get("EMBEDDING_CACHE_DTYPE", "float32"),
+    disk_max_bytes=int(float(os.environ.get("EMBEDDING_CACHE_DISK_MB", "2048")) * 1024 * 1024),
+)
+
+# Micro-batching queue for concurrent single-text encodes. It is idle (and
+# encode calls go straight to the model) until a server process calls start().
+embedding_service = BatchingEncoder(
+    _encode_batch,
+    max_batch_size=int(os.environ.get("EMBEDDING_BATCH_SIZE", "32")),
+    max_wait_ms=float(os.environ.get("EMBEDDING_BATCH_WAIT_MS", "5")),
+)
+
+def embed_texts(texts):
+    """Embed a list of ad texts through the cache, returning a float32 (n, 384) array."""
+    return embedding_cache.encode(texts, embedding_service.encode)
+
+def create_features(df, is_training=False, reducer=None):
     """
     Main function to run all feature engineering steps for the Hybrid Model.
     Expected columns:
     'Ad Topic Line', 'Age', 'Area Income', 'Male', 'Daily Time Spent on Site', 'Daily Internet Usage'
+    With a `reducer` (dim_reduction.EmbeddingReducer) the embeddings are projected
+    first, and emb_0 .. emb_{k-1} hold the reduced dimensions.
     """
     # 1. Process Tabular Data
-    tabular_features = ['Age', 'Area Income', 'Male', 'Hour', 'DayOfWeek']
+    tabular_features = TABULAR_FEATURES
     
     if 'Timestamp' in df.columns:
         df['Timestamp'] = pd.to_datetime(df['Timestamp'])
@@ -36,7 +85,9 @@ def create_features(df, is_training=False):
     if text_col in df.columns:
         print(f"Generating NLP embeddings for {len(df)} rows...")
         # Get embeddings as a numpy array
-        embeddings = embedding_model.encode(df[text_col].tolist())
+        embeddings = embed_texts(df[text_col].tolist())
+        if reducer is not None:
+            embeddings = reducer.transform(embeddings)
         
         # Convert embeddings into a DataFrame with column names emb_0, emb_1, ... emb_383
         emb_df = pd.DataFrame(embeddings, columns=[f"emb_{i}" for i in range(embeddings.shape[1])])
@@ -0,0 +1,69 @@
+# feature_plan.py
+import math
+
+import numpy as np
+
+from feature_engineering import TABULAR_FEATURES
+
+
+class FeaturePlan:
+    """
+    Compiled layout of the model input, derived once from model_columns.json.
+
+    `assemble` writes tabular values and embeddings straight into a contiguous
+    float32 matrix in model column order, without building DataFrames. It produces
+    the same bytes as `create_features(df)[model_columns].to_numpy(dtype=np.float32)`;
+    check_parity.py verifies this.
+    """
+
+    def __init__(self, model_columns):
+        self.model_columns = list(model_columns)
+        self.n_features = len(self.model_columns)
+        self.column_index = {col: i for i, col in enumerate(self.model_columns)}
+
+        self.tabular = []  # (output column, feature name)
+        emb_positions = {}
+        for i, col in enumerate(self.model_columns):
+            if col in TABULAR_FEATURES:
+                self.tabular.append((i, col))
+            elif col.startswith('emb_') and col[4:].isdigit():
+                emb_positions[int(col[4:])] = i
+            else:
+                raise ValueError(f"Column '{col}' is not produced by create_features; cannot build a feature plan.")
+
+        self.n_embedding = len(emb_positions)
+        if sorted(emb_positions) != list(range(self.n_embedding)):
+            raise ValueError("Embedding columns must be emb_0 .. emb_{n-1}.")
+        positions = np.array([emb_positions[j] for j in range(self.n_embedding)], dtype=np.intp)
+        # The usual layout is one contiguous run; a slice assignment avoids a scatter
+        if self.n_embedding and np.array_equal(positions, np.arange(positions[0], positions[0] + self.n_embedding)):
+            self.embedding_index = slice(int(positions[0]), int(positions[0]) + self.n_embedding)
+        else:
+            self.embedding_index = positions
+
+    def allocate(self, n_rows):
+        return np.empty((n_rows, self.n_features), dtype=np.float32)
+
+    def assemble(self, records, embeddings, out=None):
+        """
+        Fill `out` (or a new (n, n_features) float32 matrix) from `records`, a list of
+        dicts keyed by tabular feature name (missing or NaN values become 0, like
+        create_features), and `embeddings`, an (n, n_embedding) array.
+        """
+        n_rows = len(records)
+        if out is None:
+            out = self.allocate(n_rows)
+        for i, name in self.tabular:
+            out[:, i] = [_value(record.get(name)) for record in records]
+        if self.n_embedding:
+            embeddings = np.asarray(embeddings)
+            if embeddings.shape != (n_rows, self.n_embedding):
+                raise ValueError(f"Expected embeddings of shape {(n_rows, self.n_embedding)}, got {embeddings.shape}.")
+            out[:, self.embedding_index] = embeddings
+        return out
+
+
+def _value(v):
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return 0
+    return v
@@ -0,0 +1,163 @@
+# feature_store.py
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from feature_engineering import EMBEDDING_MODEL_NAME, TABULAR_FEATURES, create_features
+
+# Bump when create_features changes in a way that invalidates stored rows
+FEATURE_STORE_VERSION = 1
+
+# Raw input columns a feature row depends on
+KEY_COLUMNS = ['Ad Topic Line'] + TABULAR_FEATURES + ['Timestamp']
+
+# Rows copied per step when rewriting the store, to bound memory
+COPY_BLOCK_ROWS = 65536
+
+
+def row_hashes(df):
+    """16-byte content hash of each row's feature inputs, as an (n,) 'S16' array."""
+    columns = [c for c in KEY_COLUMNS if c in df.columns]
+    values = df[columns].astype(str).to_numpy()
+    return np.array(
+        [hashlib.blake2b("\x1f".join(row).encode("utf-8"), digest_size=16).digest() for row in values],
+        dtype="S16",
+    )
+
+
+class FeatureStore:
+    """
+    Materialized training features on disk, keyed by row content hash.
+
+    `root` holds:
+      features.npy    float32 (rows, columns) matrix in dataset row order
+      keys.npy        'S16' content hash of each row
+      meta.json       version, embedding model, dtype, columns and row count
+
+    With dtype="float16" the embedding columns are kept in half precision in
+    embeddings.npy, and features.npy holds only the tabular columns (values
+    like Area Income do not fit in float16).
+
+    `materialize(df)` reuses every stored row whose inputs are unchanged, runs
+    create_features only on new or changed rows, rewrites the store in the order
+    of `df`, and returns the matrix memory-mapped read-only (float16 stores are
+    returned as one in-memory float32 matrix).
+    """
+
+    def __init__(self, root, dtype="float32"):
+        self.root = root
+        self.dtype = np.dtype(dtype)
+        self.features_path = os.path.join(root, "features.npy")
+        self.embeddings_path = os.path.join(root, "embeddings.npy")
+        self.keys_path = os.path.join(root, "keys.npy")
+        self.meta_path = os.path.join(root, "meta.json")
+
+    def _expected_meta(self):
+        return {"version": FEATURE_STORE_VERSION, "embedding_model": EMBEDDING_MODEL_NAME, "dtype": self.dtype.name}
+
+    def _parts(self, columns):
+        """(file, dtype, column positions) of each stored matrix."""
+        if self.dtype == np.float32:
+            return [(self.features_path, np.dtype(np.float32), np.arange(len(columns)))]
+        is_emb = np.array([c.startswith('emb_') for c in columns], dtype=bool)
+        return [(self.features_path, np.dtype(np.float32), np.flatnonzero(~is_emb)),
+                (self.embeddings_path, self.dtype, np.flatnonzero(is_emb))]
+
+    def _load(self, columns):
+        parts = self._parts(columns)
+        if len(parts) == 1:
+            return np.load(parts[0][0], mmap_mode="r")
+        out = None
+        for path, _, positions in parts:
+            stored = np.load(path, mmap_mode="r")
+            if out is None:
+                out = np.empty((len(stored), len(columns)), dtype=np.float32)
+            out[:, positions] = stored
+        return out
+
+    def load_meta(self):
+        if not os.path.exists(self.meta_path):
+            return None
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        # A store built by another feature version, embedding model or dtype cannot be reused
+        if any(meta.get(k) != v for k, v in self._expected_meta().items()):
+            return None
+        return meta
+
+    def materialize(self, df):
+        """Return (features matrix, model columns, report) for the rows of `df`."""
+        start = time.perf_counter()
+        keys = row_hashes(df)
+        meta = self.load_meta()
+
+        if meta is not None:
+            old_keys = np.load(self.keys_path)
+            if np.array_equal(old_keys, keys):
+                report = {"rows": len(keys), "reused": len(keys), "recomputed": 0,
+                          "seconds": round(time.perf_counter() - start, 2)}
+                return self._load(meta["columns"]), meta["columns"], report
+            old_index = {k: i for i, k in enumerate(old_keys.tolist())}
+            source_rows = np.array([old_index.get(k, -1) for k in keys.tolist()], dtype=np.int64)
+        else:
+            source_rows = np.full(len(keys), -1, dtype=np.int64)
+
+        new_mask = source_rows < 0
+        new_features = None
+        if new_mask.any():
+            new_df = create_features(df[new_mask].copy(), is_training=False)
+            columns = new_df.columns.tolist()
+            if meta is not None and columns != meta["columns"]:
+                # Feature layout changed: nothing stored can be reused
+                return self._rebuild(df, start)
+            new_features = new_df.to_numpy(dtype=np.float32)
+        else:
+            columns = meta["columns"]
+
+        os.makedirs(self.root, exist_ok=True)
+        reused_at = np.flatnonzero(~new_mask)
+        tmp_paths = []
+        for path, dtype, positions in self._parts(columns):
+            tmp_path = path[:-len(".npy")] + ".tmp.npy"
+            out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(len(keys), len(positions)))
+            if new_features is not None:
+                out[new_mask] = new_features[:, positions]
+            if len(reused_at):
+                old = np.load(path, mmap_mode="r")
+                for begin in range(0, len(reused_at), COPY_BLOCK_ROWS):
+                    block = reused_at[begin:begin + COPY_BLOCK_ROWS]
+                    out[block] = old[source_rows[block]]
+                del old
+            out.flush()
+            del out
+            tmp_paths.append((tmp_path, path))
+
+        self._commit(tmp_paths, keys, columns)
+        report = {"rows": len(keys), "reused": int(len(reused_at)), "recomputed": int(new_mask.sum()),
+                  "seconds": round(time.perf_counter() - start, 2)}
+        return self._load(columns), columns, report
+
+    def _rebuild(self, df, start):
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+        features, columns, report = self.materialize(df)
+        report["seconds"] = round(time.perf_counter() - start, 2)
+        return features, columns, report
+
+    def _commit(self, tmp_paths, keys, columns):
+        # meta.json is removed first and written last, so an interrupted commit
+        # leaves no meta and the next run simply recomputes
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+        for tmp_path, path in tmp_paths:
+            os.replace(tmp_path, path)
+        tmp_keys = self.keys_path + ".tmp.npy"
+        np.save(tmp_keys, keys)
+        os.replace(tmp_keys, self.keys_path)
+        meta = {**self._expected_meta(), "columns": columns, "rows": int(len(keys))}
+        with open(self.meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
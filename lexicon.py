@@ -0,0 +1,182 @@
+# lexicon.py
+import os
+import threading
+import time
+from collections import deque
+
+# Ethical heuristic keywords (used when no LEXICON_DIR is configured)
+DEFAULT_LEXICONS = {
+    'privacy': {
+        'your friend', 'your friends', 'we saw you', 'based on your',
+        'people like you', 'your recent activity', 'know you like', 'saw you looked at'
+    },
+    'urgency': {
+        'limited time', 'only a few left', 'offer expires', "don't miss out",
+        'today only', 'hurry', 'last chance', '24-hour', 'now or never'
+    },
+    'medical': {
+        'guaranteed cure', 'miracle', '100% safe', 'doctors hate this',
+        'magic pill', 'instant weight loss', 'cure your', 'secret remedy'
+    },
+    'financial': {
+        'get rich quick', 'guaranteed return', 'no risk', 'earn fast',
+        'make millions', 'double your money', 'secret wealth', 'financial freedom guaranteed'
+    },
+}
+
+
+def _lower_with_offsets(text):
+    """Lowercase `text`, plus a map from lowered to original offsets when lowering changes length."""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered, None
+    chars, offsets = [], []
+    for i, ch in enumerate(text):
+        low = ch.lower()
+        chars.append(low)
+        offsets.extend([i] * len(low))
+    offsets.append(len(text))
+    return "".join(chars), offsets
+
+
+class CompiledLexicon:
+    """
+    Aho-Corasick automaton over the phrases of every category, so one pass over
+    the text finds all matches regardless of lexicon size. Matching is
+    case-insensitive substring matching, like the original `phrase in text.lower()`.
+    """
+
+    def __init__(self, lexicons):
+        self.categories = list(lexicons)
+        self.phrases = []  # pattern id -> (category, phrase)
+        goto = [{}]
+        outputs = [[]]
+        for category, phrases in lexicons.items():
+            for phrase in sorted({p.strip().lower() for p in phrases if p.strip()}):
+                node = 0
+                for ch in phrase:
+                    nxt = goto[node].get(ch)
+                    if nxt is None:
+                        nxt = len(goto)
+                        goto[node][ch] = nxt
+                        goto.append({})
+                        outputs.append([])
+                    node = nxt
+                outputs[node].append(len(self.phrases))
+                self.phrases.append((category, phrase))
+
+        # Breadth-first failure links; each node also inherits its fail node's outputs
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in goto[node].items():
+                queue.append(nxt)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0) if goto[f].get(ch) != nxt else 0
+                outputs[nxt] = outputs[nxt] + outputs[fail[nxt]]
+        self._goto = goto
+        self._fail = fail
+        self._outputs = outputs
+
+    def __len__(self):
+        return len(self.phrases)
+
+    def scan(self, text):
+        """
+        Return (counts, matches): the number of distinct phrases found per category,
+        and every occurrence as {"category", "phrase", "start", "end"} with character
+        offsets into the original text.
+        """
+        lowered, offsets = _lower_with_offsets(text)
+        goto, fail, outputs, phrases = self._goto, self._fail, self._outputs, self.phrases
+        counts = dict.fromkeys(self.categories, 0)
+        seen = set()
+        matches = []
+        node = 0
+        for i, ch in enumerate(lowered):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pid in outputs[node]:
+                category, phrase = phrases[pid]
+                start, end = i + 1 - len(phrase), i + 1
+                if offsets is not None:
+                    start, end = offsets[start], offsets[end]
+                matches.append({"category": category, "phrase": phrase, "start": start, "end": end})
+                if pid not in seen:
+                    seen.add(pid)
+                    counts[category] += 1
+        matches.sort(key=lambda m: (m["start"], m["end"]))
+        return counts, matches
+
+
+def load_lexicon_dir(directory):
+    """
+    Read `<category>.txt` files from `directory`: one phrase per line, blank lines
+    and lines starting with '#' are ignored.
+    """
+    lexicons = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".txt"):
+            continue
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            lexicons[name[:-4]] = {line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")}
+    return lexicons
+
+
+class LexiconEngine:
+    """
+    Serves scans from a CompiledLexicon and hot-reloads it when the files in
+    `directory` change (checked at most every `reload_interval` seconds).
+
+    A reload compiles the new automaton completely before swapping the reference,
+    so concurrent scans always see either the old or the new lexicon. Writers
+    should replace files atomically (write a temp file, then rename it).
+    """
+
+    def __init__(self, directory=None, defaults=DEFAULT_LEXICONS, reload_interval=5.0):
+        self.directory = directory
+        self.defaults = defaults
+        self.reload_interval = reload_interval
+        self._signature = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.reloads = 0
+        self._compiled = CompiledLexicon(defaults)
+        if directory:
+            self.reload()
+
+    @property
+    def compiled(self):
+        return self._compiled
+
+    def _dir_signature(self):
+        return tuple(sorted(
+            (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+            for entry in os.scandir(self.directory) if entry.name.endswith(".txt")
+        ))
+
+    def reload(self):
+        with self._lock:
+            signature = self._dir_signature()
+            compiled = CompiledLexicon(load_lexicon_dir(self.directory) or self.defaults)
+            self._compiled, self._signature = compiled, signature
+            self.reloads += 1
+
+    def maybe_reload(self):
+        if not self.directory or time.monotonic() < self._next_check:
+            return
+        self._next_check = time.monotonic() + self.reload_interval
+        try:
+            if self._dir_signature() != self._signature:
+                self.reload()
+        except OSError as e:
+            # Keep serving the last good lexicon
+            print(f"Lexicon reload failed: {e}")
+
+    def scan(self, text):
+        self.maybe_reload()
+        return self._compiled.scan(text)
@@ -0,0 +1,277 @@
+# llm.py
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+
+from groq import AsyncGroq
+
+LLM_MODEL = "llama-3.1-8b-instant"
+# Per-call timeout for a Groq completion, in seconds
+LLM_TIMEOUT_S = float(os.environ.get("LLM_TIMEOUT_S", "10"))
+
+
+class TTLCache:
+    """Small LRU cache whose entries also expire `ttl` seconds after insertion."""
+
+    def __init__(self, max_entries=1024, ttl=3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+completion_cache = TTLCache(
+    max_entries=int(os.environ.get("LLM_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("LLM_CACHE_TTL_S", "3600")),
+)
+
+_client = None
+_inflight = {}
+
+
+def get_client():
+    """Process-wide AsyncGroq client; its HTTP connection pool is reused across requests.
+
+    GROQ_BASE_URL points the client at a different server, e.g. benchmarks/groq_stub.py.
+    """
+    global _client
+    if _client is None:
+        _client = AsyncGroq(api_key=os.environ.get("GROQ_API_KEY"), timeout=LLM_TIMEOUT_S, max_retries=0)
+    return _client
+
+
+def set_client(client):
+    """Replace the shared client (e.g. with an offline stub for benchmarks)."""
+    global _client
+    _client = client
+
+
+def llm_available():
+    return _client is not None or bool(os.environ.get("GROQ_API_KEY"))
+
+
+async def _create_completion(prompt):
+    chat_completion = await get_client().chat.completions.create(
+        messages=[{"role": "user", "content": prompt}],
+        model=LLM_MODEL,
+    )
+    return chat_completion.choices[0].message.content.strip()
+
+
+async def complete(prompt, timeout=None):
+    """Cached, timed-out completion. Concurrent calls with the same prompt share one request."""
+    cached = completion_cache.get(prompt)
+    if cached is not None:
+        return cached
+    task = _inflight.get(prompt)
+    if task is None:
+        task = asyncio.ensure_future(_create_completion(prompt))
+        _inflight[prompt] = task
+        task.add_done_callback(lambda _: _inflight.pop(prompt, None))
+    # shield() so one caller timing out does not cancel the request for the others
+    text = await asyncio.wait_for(asyncio.shield(task), timeout or LLM_TIMEOUT_S)
+    completion_cache.set(prompt, text)
+    return text
+
+
+def rewrite_prompt(ad_text):
+    return f"Rewrite the following ad copy to sound professional, ethical, and compliant. Remove any creepy tracking language, aggressive urgency/scarcity tactics, unverified medical claims, or 'get rich quick' financial promises. Return ONLY the rewritten ad text without any conversational filler or quotation marks. Ad to rewrite: '{ad_text}'"
+
+
+def advice_prompt(ad_text, shap_breakdown):
+    return f"You are an expert digital marketing strategist. An ad copy '{ad_text}' was evaluated by an ML model and received the following SHAP impact scores for its features: {shap_breakdown}. Provide a single, concise sentence of actionable advice on how to rewrite or adjust the ad strategy to improve the score, specifically targeting the features with negative scores (if any). Do not use introductory filler, just give the advice directly."
+
+
+async def get_ethical_rewrite(ad_text, creepiness, urgency, medical, financial):
+    if creepiness == 0 and urgency == 0 and medical == 0 and financial == 0:
+        return None
+    if not llm_available():
+        return "⚠️ Set GROQ_API_KEY in your environment to see AI suggested rewrites."
+
+    try:
+        return await complete(rewrite_prompt(ad_text))
+    except asyncio.TimeoutError:
+        return f"⚠️ Error generating rewrite: timed out after {LLM_TIMEOUT_S:g}s"
+    except Exception as e:
+        return f"⚠️ Error generating rewrite: {str(e)}"
+
+
+async def get_counterfactual_advice(ad_text, shap_breakdown):
+    if not llm_available():
+        return "⚠️ Set GROQ_API_KEY in your environment to see counterfactual advice."
+
+    try:
+        return await complete(advice_prompt(ad_text, shap_breakdown))
+    except asyncio.TimeoutError:
+        return f"⚠️ Error generating advice: timed out after {LLM_TIMEOUT_S:g}s"
+    except Exception as e:
+        return f"⚠️ Error generating advice: {str(e)}"
+
+
+def ad_calls(result, ad_text):
+    """The LLM calls for one scored ad (a /predict-style result dict), keyed by response field."""
+    risk = result["ethical_risk_assessment"]
+    return {
+        "suggested_rewrite": get_ethical_rewrite(
+            ad_text, risk["creepiness_score"], risk["urgency_score"],
+            risk["medical_claims_score"], risk["financial_promises_score"]),
+        "counterfactual_advice": get_counterfactual_advice(ad_text, result["shap_breakdown"]),
+    }
+
+
+async def run_calls(calls):
+    """Run a {field: coroutine} mapping concurrently and return {field: result}."""
+    results = await asyncio.gather(*calls.values())
+    return dict(zip(calls.keys(), results))
+
+
+class JobStore:
+    """
+    Deferred LLM results. Each job is a set of named asyncio tasks that clients
+    can poll (GET /jobs/{id}) or stream as server-sent events (GET /jobs/{id}/events).
+    Jobs are forgotten `ttl` seconds after creation.
+
+    With a `shared_dir` (set by serve.py for multi-worker serving) every job's
+    results are also written to <shared_dir>/<id>.json as its tasks finish, so a
+    worker other than the one running the job can answer polls and streams.
+    """
+
+    def __init__(self, ttl=600.0, shared_dir=None, poll_interval=0.1):
+        self.ttl = ttl
+        self.shared_dir = shared_dir
+        self.poll_interval = poll_interval
+        self._jobs = {}
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def submit(self, calls):
+        self._expire()
+        job_id = uuid.uuid4().hex
+        tasks = {field: asyncio.ensure_future(coro) for field, coro in calls.items()}
+        self._jobs[job_id] = (time.monotonic() + self.ttl, tasks)
+        if self.shared_dir:
+            expires_at = time.time() + self.ttl
+            self._publish(job_id, tasks, expires_at)
+            for task in tasks.values():
+                task.add_done_callback(lambda _, job_id=job_id: self._publish(job_id, tasks, expires_at))
+        return job_id
+
+    def get(self, job_id):
+        self._expire()
+        job = self._jobs.get(job_id)
+        return job[1] if job else None
+
+    def poll(self, job_id):
+        """Current snapshot of a job, or None if it is unknown or expired."""
+        tasks = self.get(job_id)
+        if tasks is not None:
+            return self.snapshot(tasks)
+        shared = self._read_shared(job_id)
+        return {"status": shared["status"], "results": shared["results"]} if shared else None
+
+    def stream(self, job_id):
+        """Async iterator of (field, result) in completion order, or None if the job is unknown."""
+        tasks = self.get(job_id)
+        if tasks is not None:
+            return self.events(tasks)
+        if self._read_shared(job_id) is None:
+            return None
+        return self._shared_events(job_id)
+
+    async def _shared_events(self, job_id):
+        # Job running in another worker: follow its results file
+        sent = set()
+        while True:
+            shared = self._read_shared(job_id)
+            if shared is None:
+                return
+            for field, value in shared["results"].items():
+                if field not in sent:
+                    sent.add(field)
+                    yield field, value
+            if shared["status"] == "done":
+                return
+            await asyncio.sleep(self.poll_interval)
+
+    def _path(self, job_id):
+        return os.path.join(self.shared_dir, f"{job_id}.json")
+
+    def _publish(self, job_id, tasks, expires_at):
+        snapshot = {**self.snapshot(tasks), "expires_at": expires_at}
+        tmp = self._path(job_id) + f".{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, self._path(job_id))  # readers see the old or the new file, never a partial one
+
+    def _read_shared(self, job_id):
+        if not self.shared_dir or not JOB_ID.fullmatch(job_id):
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                shared = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return shared if shared["expires_at"] >= time.time() else None
+
+    def _expire(self):
+        now = time.monotonic()
+        for job_id in [j for j, (expires, _) in self._jobs.items() if expires < now]:
+            del self._jobs[job_id]
+            if self.shared_dir:
+                try:
+                    os.remove(self._path(job_id))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def snapshot(tasks):
+        done = all(t.done() for t in tasks.values())
+        return {
+            "status": "done" if done else "pending",
+            "results": {field: t.result() for field, t in tasks.items() if t.done()},
+        }
+
+    @staticmethod
+    async def events(tasks):
+        """Yield (field, result) pairs in completion order."""
+        async def named(field, task):
+            return field, await task
+
+        for next_done in asyncio.as_completed([named(f, t) for f, t in tasks.items()]):
+            yield await next_done
+
+
+JOB_ID = re.compile(r"[0-9a-f]{32}")
+
+# LLM_JOB_DIR: directory shared by all worker processes (serve.py sets it for --workers > 1)
+llm_jobs = JobStore(ttl=float(os.environ.get("LLM_JOB_TTL_S", "600")),
+                    shared_dir=os.environ.get("LLM_JOB_DIR") or None)
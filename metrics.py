@@ -0,0 +1,290 @@
+# metrics.py
+import bisect
+import contextlib
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+# Latency histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The request being served: its ASGI scope, model_version label and the stage
+# timings recorded so far. Threadpool workers and asyncio tasks run in a copy of the
+# request's context, so they all see (and append to) the same dict.
+_request = contextvars.ContextVar("request_metrics", default=None)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per label combination."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count], sum
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labelvalues, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames + ('le',), labelvalues + (le,))} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Collector:
+    """
+    Gauges or counters read at scrape time from `fn`, which returns a number or a
+    {label values tuple: number} dict. Nothing is recorded on the request path.
+    """
+
+    def __init__(self, name, documentation, fn, labelnames=(), kind="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+
+    def render(self):
+        try:
+            values = self.fn()
+        except Exception:
+            return []  # a component that is not loaded yet simply reports nothing
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labelvalues, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {float(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, documentation, fn, labelnames=()):
+        self._metrics.append(Collector(name, documentation, fn, labelnames, "gauge"))
+
+    def counter(self, name, documentation, fn, labelnames=()):
+        self._metrics.append(Collector(name, documentation, fn, labelnames, "counter"))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    "adpredictor_stage_seconds", "Time spent in each stage of the request pipeline.",
+    ("stage", "endpoint", "model_version"))
+request_seconds = registry.histogram(
+    "adpredictor_request_seconds", "End-to-end request latency.",
+    ("endpoint", "method", "status", "model_version"))
+
+
+# Stack profiles of the slowest sampled requests, newest last
+outlier_profiles = deque(maxlen=20)
+
+
+def _endpoint(scope):
+    # The route template (e.g. /jobs/{job_id}) keeps label cardinality bounded
+    return getattr(scope.get("route"), "path", None) or "unmatched"
+
+
+def set_label(name, value):
+    """Attach a label (e.g. model_version) to the request being served, if any."""
+    request = _request.get()
+    if request is not None:
+        request[name] = value
+
+
+def record(name, seconds):
+    request = _request.get()
+    if request is None:
+        return  # warmup, benchmarks and other calls outside an HTTP request
+    request["stages"].append((name, seconds))
+    stage_seconds.observe(seconds, name, _endpoint(request["scope"]), request["model_version"])
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Time a block as pipeline stage `name` of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+async def timed(name, coro):
+    """Await `coro`, timing it as stage `name`; cancellation and timeouts are timed too."""
+    start = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def stage_totals(stages):
+    """Summed duration per stage name (A/B and batch requests run stages more than once)."""
+    durations = {}
+    for name, seconds in stages:
+        durations[name] = durations.get(name, 0.0) + seconds
+    return durations
+
+
+def server_timing(stages, total):
+    """`Server-Timing` header value: summed duration per stage plus the total, in ms."""
+    durations = stage_totals(stages)
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in durations.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+# Threads that are parked waiting for work rather than running a request
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py", "thread.py", "_base.py")
+
+
+class StackSampler:
+    """
+    Low-rate statistical profiler for sampled requests. While at least one
+    sampled request is in flight, a background thread records the stack of every
+    busy thread every `interval` seconds; each request collects the samples taken
+    during its lifetime as collapsed (flamegraph-ready) stacks.
+    """
+
+    def __init__(self, interval=0.005, max_depth=40):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def begin(self):
+        token = object()
+        with self._lock:
+            self._active[token] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        return token
+
+    def end(self, token):
+        with self._lock:
+            return self._active.pop(token, Counter())
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident != own and not frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    stacks.append(self._collapse(frame))
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                for counter in self._active.values():
+                    counter.update(stacks)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: times each HTTP request, observes `adpredictor_request_seconds`,
+    and adds a `Server-Timing` header with the per-stage breakdown.
+
+    With `profile_sample_rate` > 0 that fraction of requests is stack-sampled; the
+    profiles of those slower than `profile_outlier_ms` are kept in `outlier_profiles`.
+    """
+
+    def __init__(self, app, profile_sample_rate=0.0, profile_outlier_ms=500.0, sampler=None):
+        self.app = app
+        self.profile_sample_rate = profile_sample_rate
+        self.profile_outlier_ms = profile_outlier_ms
+        self.sampler = sampler or StackSampler()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        request = {"scope": scope, "model_version": "", "stages": []}
+        token = _request.set(request)
+        profile = self.sampler.begin() if random.random() < self.profile_sample_rate else None
+        status = [500]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                header = server_timing(request["stages"], time.perf_counter() - start)
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"server-timing", header.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request.reset(token)
+            elapsed = time.perf_counter() - start
+            endpoint = _endpoint(scope)
+            request_seconds.observe(elapsed, endpoint, scope["method"], str(status[0]), request["model_version"])
+            if profile is not None:
+                stacks = self.sampler.end(profile)
+                if elapsed * 1000 >= self.profile_outlier_ms:
+                    outlier_profiles.append({
+                        "endpoint": endpoint,
+                        "model_version": request["model_version"],
+                        "status": status[0],
+                        "duration_ms": round(elapsed * 1000, 2),
+                        "stages_ms": {name: round(s * 1000, 3) for name, s in stage_totals(request["stages"]).items()},
+                        "timestamp": time.time(),
+                        "samples": sum(stacks.values()),
+                        "stacks": [f"{stack} {count}" for stack, count in stacks.most_common(50)],
+                    })
@@ -0,0 +1,319 @@
+# model_registry.py
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import joblib
+import numpy as np
+import xgboost as xgb
+
+from dim_reduction import load_reducer, reducer_path
+from explain import make_explainer, breakdowns
+from feature_plan import FeaturePlan
+import sweep
+
+NATIVE_FORMATS = (".json", ".ubj")
+
+
+def load_booster(path):
+    """Load an XGBoost model from native JSON/UBJ (no pickle) or from a joblib'd sklearn wrapper."""
+    if path.endswith(NATIVE_FORMATS):
+        return xgb.Booster(model_file=path)
+    model = joblib.load(path)
+    return model.get_booster() if hasattr(model, "get_booster") else model
+
+
+def resolve_model_file(path):
+    """`path` itself, or for a model directory the file it serves: native export first, then model.joblib."""
+    if not os.path.isdir(path):
+        return path
+    for name in ('model.ubj', 'model.json', 'model.joblib'):
+        candidate = os.path.join(path, name)
+        if os.path.exists(candidate):
+            return candidate
+    return os.path.join(path, 'model.joblib')
+
+
+def _mtimes(paths):
+    return tuple(os.stat(p).st_mtime_ns if os.path.exists(p) else None for p in paths)
+
+
+class ModelVersion:
+    """
+    One servable model and everything derived from it, built once at registration:
+    the booster, its embedding reducer (if trained with one), feature plan and explainer. A warm-up row is pushed through
+    predict and explain so the first live request pays no lazy-initialization cost.
+
+    `model_path` may be a directory such as saved_model/: the version then serves
+    whichever model file it holds (see resolve_model_file), re-resolved on reload.
+    """
+
+    def __init__(self, name, model_path, columns_path=None):
+        self.name = name
+        self.model_path = model_path
+        self.model_file = resolve_model_file(model_path)
+        self.columns_path = columns_path
+        self.mtimes = _mtimes(self.paths)
+
+        self.booster = load_booster(self.model_file)
+        # Per-process XGBoost thread budget (set by serve.py for each worker)
+        if os.environ.get("XGBOOST_NTHREAD"):
+            self.booster.set_param({"nthread": int(os.environ["XGBOOST_NTHREAD"])})
+        if columns_path:
+            with open(columns_path, 'r') as f:
+                self.model_columns = json.load(f)
+        else:
+            self.model_columns = list(self.booster.feature_names or [])
+        self.plan = FeaturePlan(self.model_columns)
+        self.reducer = load_reducer(columns_path)
+        if self.reducer is not None and self.reducer.output_dim != self.plan.n_embedding:
+            raise ValueError(f"Reducer outputs {self.reducer.output_dim} dimensions; "
+                             f"the model has {self.plan.n_embedding} embedding columns.")
+        self.explainer = make_explainer(self.booster, self.model_columns)
+
+        warm_row = self.plan.allocate(1)
+        warm_row[:] = 0
+        sweep.score_rows(self.booster, warm_row)
+        breakdowns(self.explainer, warm_row)
+        self.loaded_at = time.time()
+
+    @property
+    def paths(self):
+        reducer = reducer_path(self.columns_path) if self.columns_path else None
+        return [p for p in (self.model_file, self.columns_path, reducer) if p]
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "model_path": self.model_path,
+            "model_file": self.model_file,
+            "columns_path": self.columns_path,
+            "n_features": self.plan.n_features,
+            "reduction": f"{self.reducer.kind} {self.reducer.input_dim}->{self.reducer.output_dim}" if self.reducer else None,
+            "loaded_at": self.loaded_at,
+        }
+
+
+class ModelRegistry:
+    """
+    Versioned models served side by side, with an active version, optional
+    weighted traffic routing, and atomic hot-swap.
+
+    Readers call `route()` once per request and use the returned ModelVersion
+    throughout, so a swap never changes the model under an in-flight request.
+    Writers build the new ModelVersion completely before publishing it.
+
+    With a `state_path` (set by serve.py for multi-worker serving), admin changes
+    are saved there by `save_state()` and picked up by every other process's
+    watcher through `sync_state()`.
+    """
+
+    def __init__(self, state_path=None):
+        self.state_path = state_path
+        self._state_mtime = None
+        self._versions = {}
+        self._weights = {}
+        self._active = None
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+
+    def __len__(self):
+        return len(self._versions)
+
+    @property
+    def active(self):
+        return self._versions.get(self._active)
+
+    def register(self, name, model_path, columns_path=None, activate=False):
+        version = ModelVersion(name, model_path, columns_path)
+        with self._lock:
+            versions = dict(self._versions)
+            versions[name] = version
+            self._versions = versions  # publish a new dict; readers never see a partial update
+            self._errors.pop(name, None)
+            if activate or self._active is None:
+                self._active = name
+                self._weights = {name: 1.0}
+        return version
+
+    def try_register(self, name, model_path, columns_path=None, activate=False):
+        """Like register(), but records the error and returns None on failure."""
+        try:
+            return self.register(name, model_path, columns_path, activate)
+        except Exception as e:
+            self._errors[name] = f"{type(e).__name__}: {e}"
+            print(f"Model registry: could not load '{name}' from {model_path}: {e}")
+            return None
+
+    def activate(self, name):
+        with self._lock:
+            if name not in self._versions:
+                raise KeyError(name)
+            self._active = name
+            self._weights = {name: 1.0}
+
+    def set_routing(self, weights):
+        """Split traffic between versions, e.g. {"v1": 0.9, "v2": 0.1}."""
+        unknown = [name for name in weights if name not in self._versions]
+        if unknown:
+            raise KeyError(", ".join(unknown))
+        if not weights or any(w < 0 for w in weights.values()) or sum(weights.values()) <= 0:
+            raise ValueError("Routing weights must be non-negative and sum to a positive value.")
+        with self._lock:
+            self._weights = {name: float(w) for name, w in weights.items() if w > 0}
+
+    def get(self, name):
+        return self._versions[name]
+
+    def versions(self):
+        return list(self._versions.values())
+
+    def route(self, key=None):
+        """
+        Pick the version to serve a request. With a `key` (e.g. a user or campaign id)
+        the choice is sticky; without one it is random according to the weights.
+        """
+        weights = self._weights
+        if not weights:
+            return self.active
+        if len(weights) == 1:
+            # All traffic to one version, which need not be the active one
+            return self._versions[next(iter(weights))]
+        names = list(weights)
+        cumulative = np.cumsum([weights[n] for n in names])
+        if key is None:
+            point = random.random() * cumulative[-1]
+        else:
+            digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest()
+            point = int.from_bytes(digest, "little") / 2 ** 64 * cumulative[-1]
+        return self._versions[names[int(np.searchsorted(cumulative, point, side="right"))]]
+
+    def reload_changed(self, force=False):
+        """
+        Rebuild versions whose files changed on disk (or all of them with `force`),
+        including a model directory that now serves a different file (e.g. model.json
+        written by streaming training in place of model.joblib).
+        """
+        reloaded = []
+        for name, version in list(self._versions.items()):
+            if (force or resolve_model_file(version.model_path) != version.model_file
+                    or _mtimes(version.paths) != version.mtimes):
+                if self.try_register(name, version.model_path, version.columns_path) is not None:
+                    reloaded.append(name)
+        return reloaded
+
+    def save_state(self):
+        """Write the registered versions, active version and routing to `state_path`."""
+        if not self.state_path:
+            return
+        state = {
+            "models": [{"name": v.name, "model": v.model_path, "columns": v.columns_path}
+                       for v in self._versions.values()],
+            "active": self._active,
+            "routing": dict(self._weights),
+        }
+        tmp = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_path)
+        self._state_mtime = os.stat(self.state_path).st_mtime_ns  # our own change: nothing to sync
+
+    def sync_state(self):
+        """Apply a state file saved by another process since the last sync. Returns True if one was read."""
+        if not self.state_path:
+            return False
+        try:
+            mtime = os.stat(self.state_path).st_mtime_ns
+            if mtime == self._state_mtime:
+                return False
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self._state_mtime = mtime
+        for spec in state["models"]:
+            current = self._versions.get(spec["name"])
+            if current is None or (current.model_path, current.columns_path) != (spec["model"], spec.get("columns")):
+                self.try_register(spec["name"], spec["model"], spec.get("columns"))
+        if state.get("active") in self._versions:
+            self.activate(state["active"])
+        try:
+            self.set_routing(state.get("routing") or {})
+        except (KeyError, ValueError) as e:
+            print(f"Model registry: ignoring shared routing {state.get('routing')}: {e}")
+        return True
+
+    def watch(self, interval):
+        """Poll model files (and the shared state) every `interval` seconds and hot-swap changed versions."""
+        def loop():
+            while not self._stop.wait(interval):
+                if self.sync_state():
+                    print(f"Model registry: applied shared state (active {self._active}, routing {self._weights})")
+                reloaded = self.reload_changed()
+                if reloaded:
+                    print(f"Model registry: reloaded {', '.join(reloaded)}")
+
+        if self._watcher is None:
+            self._stop.clear()
+            self._watcher = threading.Thread(target=loop, name="model-watcher", daemon=True)
+            self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def describe(self):
+        return {
+            "active": self._active,
+            "routing": dict(self._weights),
+            "versions": [v.describe() for v in self._versions.values()],
+            "errors": dict(self._errors),
+        }
+
+
+def default_model_path():
+    # Prefer the native XGBoost export when present: faster and safer to load than pickle
+    return resolve_model_file('saved_model')
+
+
+def build_registry(config_path=None, state_path=None):
+    """
+    Registry from a JSON config ({"models": [{"name", "model", "columns"}...],
+    "active": name, "routing": {name: weight}}), or the single default model.
+    `state_path` shares admin changes between processes (see ModelRegistry).
+    """
+    registry = ModelRegistry(state_path)
+    if config_path:
+        with open(config_path) as f:
+            config = json.load(f)
+    else:
+        # The directory, not the file it holds today: retraining may replace
+        # model.joblib by model.json (or back), and the watcher follows
+        config = {"models": [{"name": "v1", "model": 'saved_model',
+                              "columns": 'saved_model/model_columns.json'}]}
+    for spec in config["models"]:
+        registry.try_register(spec["name"], spec["model"], spec.get("columns"))
+    if config.get("active") in registry._versions:
+        registry.activate(config["active"])
+    if config.get("routing"):
+        registry.set_routing(config["routing"])
+    if registry.active is None:
+        raise FileNotFoundError(f"No model could be loaded: {registry.describe()['errors']}")
+    return registry
+
+
+if __name__ == "__main__":
+    # Export a joblib model to XGBoost's native format:
+    #     python model_registry.py export saved_model/model.joblib saved_model/model.ubj
+    if len(sys.argv) != 4 or sys.argv[1] != "export":
+        sys.exit("usage: python model_registry.py export <model.joblib> <model.json|model.ubj>")
+    load_booster(sys.argv[2]).save_model(sys.argv[3])
+    print(f"Saved {sys.argv[3]}")
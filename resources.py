@@ -0,0 +1,64 @@
+# resources.py
+import threading
+import time
+
+
+class ResourceManager:
+    """
+    Registry of heavy, lazily-loaded process resources (models, explainers, ...).
+
+    Each resource is loaded on first `get()` by its registered loader, at most once
+    even under concurrent access, and its load time is recorded for the startup
+    report. A failed load is not cached, so the next `get()` retries it. Neither
+    is a missing optional resource (a loader returning None) registered with
+    `retry_missing_s`: get() returns None and calls the loader again once that
+    many seconds have passed.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._values = {}
+        self._locks = {}
+        self._timings = {}
+        self._retry_missing = {}
+        self._retry_at = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader, retry_missing_s=None):
+        with self._lock:
+            self._loaders[name] = loader
+            self._retry_missing[name] = retry_missing_s
+            self._locks.setdefault(name, threading.Lock())
+            self._values.pop(name, None)
+            self._retry_at.pop(name, None)
+
+    def get(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        with self._locks[name]:
+            if name not in self._values:
+                if time.monotonic() < self._retry_at.get(name, 0.0):
+                    return None
+                start = time.perf_counter()
+                value = self._loaders[name]()
+                self._timings[name] = round(time.perf_counter() - start, 4)
+                if value is None and self._retry_missing.get(name) is not None:
+                    self._retry_at[name] = time.monotonic() + self._retry_missing[name]
+                    return None
+                self._values[name] = value
+            return self._values[name]
+
+    def is_loaded(self, name):
+        return name in self._values
+
+    def names(self):
+        return list(self._loaders)
+
+    def timings(self):
+        """Seconds spent loading each resource that has been loaded so far."""
+        return dict(self._timings)
+
+
+resources = ResourceManager()
@@ -0,0 +1,210 @@
+# serve.py
+#
+# Multi-process serving: models are loaded once in this parent process, then
+# worker processes are forked and share the read-only weights copy-on-write.
+# Every worker gets an explicit CPU thread budget for torch, XGBoost and
+# OpenMP/BLAS, so N workers never spawn N x cores threads.
+#
+#     python serve.py --workers 4 --threads-per-worker 2 --port 7860
+#
+# SIGTERM/SIGINT stop the workers gracefully; SIGUSR1 prints a memory report.
+# Metrics (/metrics, /debug/profiles) stay per worker: each scrape sees the
+# worker that answered it.
+import argparse
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+# Libraries that read these at import time: pin them before numpy/torch/xgboost load
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "NUMEXPR_NUM_THREADS",
+                   "VECLIB_MAXIMUM_THREADS")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the API from forked workers sharing preloaded models")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "1")))
+    parser.add_argument("--threads-per-worker", type=int,
+                        help="torch/XGBoost/BLAS threads per worker (default: cores / workers)")
+    parser.add_argument("--report-interval", type=float, default=0,
+                        help="print the per-worker memory report every N seconds (0: only at startup and on SIGUSR1)")
+    return parser.parse_args()
+
+
+def process_memory(pid):
+    """Resident (RSS), proportional (PSS), shared and private memory of a process in bytes, from smaps_rollup."""
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared_clean", "Shared_Dirty": "shared_dirty",
+              "Private_Clean": "private_clean", "Private_Dirty": "private_dirty"}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None  # not Linux, or the process is gone
+    memory = {}
+    for line in lines:
+        parts = line.split()
+        if parts and parts[0].rstrip(":") in fields:
+            memory[fields[parts[0].rstrip(":")]] = int(parts[1]) * 1024
+    return memory
+
+
+def memory_report(parent_pid, workers):
+    mb = lambda n: f"{n / 2 ** 20:>9.1f}"
+    rows = [("parent", parent_pid)] + [(f"worker {i}", pid) for i, pid in sorted(workers.items())]
+    lines = [f"{'process':<10} {'pid':>7} {'RSS MB':>9} {'PSS MB':>9} {'shared MB':>9} {'private MB':>10}"]
+    total_pss = 0
+    for name, pid in rows:
+        m = process_memory(pid)
+        if m is None:
+            lines.append(f"{name:<10} {pid:>7}   (memory unavailable)")
+            continue
+        shared = m.get("shared_clean", 0) + m.get("shared_dirty", 0)
+        private = m.get("private_clean", 0) + m.get("private_dirty", 0)
+        total_pss += m.get("pss", 0)
+        lines.append(f"{name:<10} {pid:>7} {mb(m['rss'])} {mb(m.get('pss', 0))} {mb(shared)} {mb(private):>10}")
+    # PSS splits shared pages between the processes mapping them, so it sums to real usage
+    lines.append(f"{'total':<10} {'':>7} {'':>9} {mb(total_pss)}")
+    return "\n".join(lines)
+
+
+def apply_thread_budget(threads):
+    """Limit every thread pool in this (worker) process to `threads`."""
+    from threadpoolctl import threadpool_limits
+    from resources import resources
+
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    threadpool_limits(limits=threads)  # OpenMP and BLAS pools already loaded
+    # XGBoost reads nthread per booster; versions registered later read XGBOOST_NTHREAD
+    os.environ["XGBOOST_NTHREAD"] = str(threads)
+    if resources.is_loaded("model_registry"):
+        for version in resources.get("model_registry").versions():
+            version.booster.set_param({"nthread": threads})
+
+
+def run_worker(sock, args, threads):
+    import gc
+    import uvicorn
+    import api
+
+    gc.enable()
+    apply_thread_budget(threads)
+    config = uvicorn.Config(api.app, host=args.host, port=args.port, lifespan="on", log_level="info")
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    args = parse_args()
+    threads = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+
+    # 1. Preload single-threaded: no OpenMP/BLAS pool is started before fork, which
+    #    keeps the children fork-safe and lets each size its own pools
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = "1"
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    os.environ["XGBOOST_NTHREAD"] = "1"
+
+    # Per-process state that must agree across workers goes through files: deferred
+    # LLM job results (any worker can answer a poll) and admin registry changes
+    # (applied by every worker's model watcher)
+    shared_dir = None
+    if args.workers > 1:
+        shared_dir = tempfile.mkdtemp(prefix="adpredictor-")
+        os.environ.setdefault("LLM_JOB_DIR", os.path.join(shared_dir, "jobs"))
+        os.makedirs(os.environ["LLM_JOB_DIR"], exist_ok=True)
+        os.environ.setdefault("MODEL_REGISTRY_STATE", os.path.join(shared_dir, "registry.json"))
+        if float(os.environ.get("MODEL_WATCH_S", "5")) <= 0:
+            print("Warning: MODEL_WATCH_S=0, so admin model changes only reach the worker that receives them")
+
+    import gc
+    gc.disable()  # no collections while loading: objects stay untouched until frozen
+
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    import api
+
+    print(f"Preloading models in parent process {os.getpid()}...")
+    start = time.perf_counter()
+    api.warmup()
+    if not api.startup_report["ready"]:
+        sys.exit(f"Preload failed: {api.startup_report['error']}")
+    print(f"Preloaded in {time.perf_counter() - start:.1f}s: {api.startup_report['components']}")
+
+    # 2. Move everything allocated so far out of the collector's view; otherwise the
+    #    first gc pass in each worker would write to (and un-share) every object page
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET6 if ":" in args.host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    # 3. Fork the workers; all accept() on the one listening socket
+    workers = {}
+    stopping = False
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1):
+                signal.signal(sig, signal.SIG_DFL)
+            try:
+                run_worker(sock, args, threads)
+            finally:
+                os._exit(0)
+        workers[slot] = pid
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers.values():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGUSR1, lambda signum, frame: print(memory_report(os.getpid(), workers), flush=True))
+
+    for slot in range(args.workers):
+        spawn(slot)
+    print(f"Serving on {args.host}:{args.port} with {args.workers} workers x {threads} threads", flush=True)
+
+    next_report = time.monotonic() + 10  # once the workers have warmed up
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            slot = next((s for s, p in workers.items() if p == pid), None)
+            if slot is not None:
+                del workers[slot]
+                if not stopping:
+                    # 4. A crashed worker is replaced by a fresh fork of the preloaded parent
+                    print(f"Worker {slot} (pid {pid}) exited with status {status}; restarting", flush=True)
+                    spawn(slot)
+            continue
+        if not stopping and next_report is not None and time.monotonic() >= next_report:
+            print(memory_report(os.getpid(), workers), flush=True)
+            next_report = time.monotonic() + args.report_interval if args.report_interval > 0 else None
+        time.sleep(0.2)
+    if shared_dir:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# streaming_train.py
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from dim_reduction import fit_reducer, reducer_path
+from feature_engineering import EMBEDDING_DIM, TABULAR_FEATURES, create_features, embedding_cache
+from feature_store import row_hashes
+
+# Same model as the in-memory XGBClassifier(n_estimators=100, learning_rate=0.1, random_state=42)
+XGB_PARAMS = {
+    "objective": "binary:logistic",
+    "eval_metric": "logloss",
+    "eta": 0.1,
+    "tree_method": "hist",
+    "max_bin": 256,
+    "seed": 42,
+}
+NUM_BOOST_ROUND = 100
+
+# Resolution of the score histogram used for the streaming AUC
+AUC_BINS = 1 << 16
+
+
+def inject_demo_labels(df):
+    """
+    Artificial temporal correlations for demonstration purposes, so that the
+    model actually learns to use Hour and DayOfWeek.
+    """
+    timestamps = pd.to_datetime(df['Timestamp'])
+    # Late night ads (midnight to 6am) perform poorly
+    df.loc[(timestamps.dt.hour < 6).values, 'Clicked on Ad'] = 0
+    # Weekend ads perform exceptionally well
+    df.loc[(timestamps.dt.dayofweek >= 5).values, 'Clicked on Ad'] = 1
+    return df
+
+
+def test_mask(df, test_fraction):
+    """
+    Deterministic train/test assignment from each row's content hash: a row lands
+    on the same side however the data is chunked or ordered, and duplicates never
+    straddle the split.
+    """
+    digests = row_hashes(df)
+    position = np.frombuffer(digests.tobytes(), dtype="<u8")[::2] / 2.0 ** 64
+    return position < test_fraction
+
+
+def iter_chunks(paths, chunk_size, split, test_fraction):
+    """(raw chunk, labels) of the `split` ("train" or "test") rows of every CSV in `paths`."""
+    for path in paths:
+        for chunk in pd.read_csv(path, chunksize=chunk_size):
+            is_test = test_mask(chunk, test_fraction)  # on the raw row, before any label rules
+            chunk = inject_demo_labels(chunk)
+            chunk = chunk[is_test if split == "test" else ~is_test]
+            if len(chunk):
+                yield chunk.reset_index(drop=True)
+
+
+class ChunkIterator(xgb.DataIter):
+    """
+    Feeds XGBoost one CSV chunk at a time. Each chunk is embedded in batches
+    through the embedding cache and released once XGBoost has copied it into its
+    external-memory pages under `cache_prefix`, so memory is bounded by one chunk.
+
+    XGBoost iterates more than once (quantile sketch, then pages). The first
+    pass spills each chunk's float32 feature rows and labels to .npy files in
+    `spill_dir`; later passes replay those instead of re-reading and
+    re-embedding the CSVs. close() removes them.
+    """
+
+    def __init__(self, paths, chunk_size, test_fraction, reducer, model_columns, cache_prefix, spill_dir):
+        self.paths = paths
+        self.chunk_size = chunk_size
+        self.test_fraction = test_fraction
+        self.reducer = reducer
+        self.model_columns = model_columns
+        self.spill_dir = spill_dir
+        self.rows = 0
+        self._chunks = None
+        self._spilled = []  # (features path, labels path) per chunk of the first pass
+        self._complete = False
+        self._position = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def reset(self):
+        if self._chunks is not None and not self._complete:
+            # Interrupted first pass: start it again from the CSVs
+            self._discard_spill()
+            self._chunks = None
+        self._position = 0
+
+    def next(self, input_data):
+        if self._complete:
+            if self._position == len(self._spilled):
+                return False
+            X_path, y_path = self._spilled[self._position]
+            self._position += 1
+            input_data(data=np.load(X_path), label=np.load(y_path), feature_names=self.model_columns)
+            return True
+
+        if self._chunks is None:
+            self._chunks = iter_chunks(self.paths, self.chunk_size, "train", self.test_fraction)
+            self.rows = 0
+            os.makedirs(self.spill_dir, exist_ok=True)
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._complete = True
+            self._chunks = None
+            return False
+        X, y = chunk_features(chunk, self.reducer, self.model_columns)
+        y = np.asarray(y, dtype=np.float32)
+        paths = tuple(os.path.join(self.spill_dir, f"chunk-{len(self._spilled):06d}.{kind}.npy") for kind in ("X", "y"))
+        np.save(paths[0], X)
+        np.save(paths[1], y)
+        self._spilled.append(paths)
+        self.rows += len(y)
+        input_data(data=X, label=y, feature_names=self.model_columns)
+        return True
+
+    def _discard_spill(self):
+        for paths in self._spilled:
+            for path in paths:
+                os.remove(path)
+        self._spilled = []
+
+    def close(self):
+        self._discard_spill()
+        self._complete = False
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+
+def chunk_features(chunk, reducer, model_columns):
+    X, y = create_features(chunk, is_training=True, reducer=reducer)
+    return np.ascontiguousarray(X[model_columns].to_numpy(dtype=np.float32)), y
+
+
+class StreamingMetrics:
+    """Accuracy, per-class precision/recall, log loss and (binned) AUC accumulated chunk by chunk."""
+
+    def __init__(self, bins=AUC_BINS):
+        self.bins = bins
+        self.confusion = np.zeros((2, 2), dtype=np.int64)  # [actual, predicted]
+        self.logloss_sum = 0.0
+        self.pos_hist = np.zeros(bins, dtype=np.int64)
+        self.neg_hist = np.zeros(bins, dtype=np.int64)
+
+    def update(self, y, probs):
+        y = np.asarray(y).astype(np.int64)
+        pred = (probs > 0.5).astype(np.int64)
+        np.add.at(self.confusion, (y, pred), 1)
+        p = np.clip(probs.astype(np.float64), 1e-15, 1 - 1e-15)
+        self.logloss_sum -= float(np.sum(y * np.log(p) + (1 - y) * np.log(1 - p)))
+        bins = np.minimum((probs * self.bins).astype(np.int64), self.bins - 1)
+        self.pos_hist += np.bincount(bins[y == 1], minlength=self.bins)
+        self.neg_hist += np.bincount(bins[y == 0], minlength=self.bins)
+
+    def result(self):
+        n = int(self.confusion.sum())
+        pos, neg = int(self.pos_hist.sum()), int(self.neg_hist.sum())
+        # P(score of a positive > score of a negative), ties within a bin counted as half
+        neg_below = np.cumsum(self.neg_hist) - self.neg_hist
+        auc = float(np.sum(self.pos_hist * (neg_below + 0.5 * self.neg_hist))) / (pos * neg) if pos and neg else None
+        per_class = {}
+        for label in (0, 1):
+            tp = self.confusion[label, label]
+            predicted, actual = self.confusion[:, label].sum(), self.confusion[label, :].sum()
+            precision = tp / predicted if predicted else 0.0
+            recall = tp / actual if actual else 0.0
+            f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+            per_class[str(label)] = {"precision": round(float(precision), 4), "recall": round(float(recall), 4),
+                                     "f1": round(float(f1), 4), "support": int(actual)}
+        return {
+            "rows": n,
+            "accuracy": round(float(np.trace(self.confusion)) / n, 4) if n else None,
+            "auc": round(auc, 4) if auc is not None else None,
+            "logloss": round(self.logloss_sum / n, 4) if n else None,
+            "classes": per_class,
+        }
+
+
+def fit_streaming_reducer(kind, dim, paths, chunk_size, test_fraction):
+    # PCA is fitted on the first training chunk, so it needs no more memory than one chunk
+    if kind == "none":
+        return None
+    first = next(iter_chunks(paths, chunk_size, "train", test_fraction))
+    X, _ = create_features(first, is_training=True)
+    emb = X[[c for c in X.columns if c.startswith('emb_')]].to_numpy(dtype=np.float32)
+    return None if dim >= emb.shape[1] else fit_reducer(kind, emb, dim)
+
+
+def train_streaming(paths, chunk_size=50000, test_fraction=0.2, reduction="none", dim=64,
+                    cache_dir=".cache/xgb_external", output_dir="saved_model"):
+    """Train, evaluate and save the model without ever holding the whole dataset in memory."""
+    start = time.perf_counter()
+    # A one-off pass over the whole dataset would evict the API's hot entries from
+    # the shared disk embedding store; read it, but keep new embeddings out of it
+    embedding_cache.disk_writes = False
+    reducer = fit_streaming_reducer(reduction, dim, paths, chunk_size, test_fraction)
+    embedding_dim = reducer.output_dim if reducer is not None else EMBEDDING_DIM
+    model_columns = TABULAR_FEATURES + [f"emb_{i}" for i in range(embedding_dim)]
+
+    # 1. External-memory training matrix built from the chunk iterator
+    os.makedirs(cache_dir, exist_ok=True)
+    iterator = ChunkIterator(paths, chunk_size, test_fraction, reducer, model_columns,
+                             cache_prefix=os.path.join(cache_dir, "train"),
+                             spill_dir=os.path.join(cache_dir, "chunks"))
+    try:
+        if hasattr(xgb, "ExtMemQuantileDMatrix"):
+            dtrain = xgb.ExtMemQuantileDMatrix(iterator, max_bin=XGB_PARAMS["max_bin"])
+        else:
+            dtrain = xgb.DMatrix(iterator)
+    finally:
+        iterator.close()
+    print(f"Training on {dtrain.num_row()} rows x {dtrain.num_col()} features (external memory in {cache_dir})...")
+    booster = xgb.train(XGB_PARAMS, dtrain, num_boost_round=NUM_BOOST_ROUND)
+    booster.feature_names = model_columns
+    del dtrain
+
+    # 2. Evaluate chunk by chunk on the hash-selected test rows
+    metrics = StreamingMetrics()
+    for chunk in iter_chunks(paths, chunk_size, "test", test_fraction):
+        X, y = chunk_features(chunk, reducer, model_columns)
+        metrics.update(y, booster.inplace_predict(X))
+    report = metrics.result()
+    report["seconds"] = round(time.perf_counter() - start, 2)
+    print("Model Evaluation on Test Set:")
+    print(f"Accuracy: {report['accuracy']}  AUC: {report['auc']}  Log loss: {report['logloss']}  ({report['rows']} rows)")
+    for label, stats in report["classes"].items():
+        print(f"  class {label}: precision {stats['precision']:.2f}  recall {stats['recall']:.2f}  "
+              f"f1 {stats['f1']:.2f}  support {stats['support']}")
+    print(f"Embedding cache: {embedding_cache.stats()}")
+
+    # 3. Save in XGBoost's native format (served in preference to model.joblib)
+    columns_path = os.path.join(output_dir, "model_columns.json")
+    with open(columns_path, "w") as f:
+        json.dump(model_columns, f)
+    if reducer is not None:
+        reducer.save(reducer_path(columns_path))
+    elif os.path.exists(reducer_path(columns_path)):
+        os.remove(reducer_path(columns_path))
+    # Written before the stale files go, so a watching registry always finds a model.
+    # model.ubj would shadow the new model.json, and model.joblib would still hold
+    # the previous model for anything loading it directly.
+    booster.save_model(os.path.join(output_dir, "model.json"))
+    for stale in ("model.ubj", "model.joblib"):
+        if os.path.exists(os.path.join(output_dir, stale)):
+            os.remove(os.path.join(output_dir, stale))
+    with open(os.path.join(output_dir, "streaming_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nModel saved to {os.path.join(output_dir, 'model.json')} ({report['seconds']}s)")
+    return booster, report
@@ -0,0 +1,68 @@
+# sweep.py
+import numpy as np
+
+# What-if axis name -> model column it overrides
+SWEEP_AXES = {
+    "age": "Age",
+    "income": "Area Income",
+    "gender": "Male",
+    "hour": "Hour",
+    "day_of_week": "DayOfWeek",
+}
+
+# Representative values for the audience insight buckets
+AGE_BUCKETS = [(21, "18-24"), (30, "25-34"), (40, "35-44"), (50, "45-54"), (60, "55+")]
+INCOME_BUCKETS = [(30000, "<$40k"), (50000, "$40k-$60k"), (70000, "$60k-$80k"), (90000, ">$80k")]
+
+
+def score_rows(model, X):
+    """Click probability for each row of a float32 matrix in model column order, in one booster call."""
+    booster = model.get_booster() if hasattr(model, "get_booster") else model
+    return booster.inplace_predict(X)
+
+
+def build_grid(base_row, column_index, axes):
+    """
+    Tile `base_row` (one feature vector, embedding included) over the Cartesian
+    product of `axes` ({axis name: values}) into one contiguous float32 matrix.
+    Returns (matrix, grid shape); row order is C order over the axes as given.
+    """
+    values = [np.asarray(v, dtype=np.float32) for v in axes.values()]
+    shape = tuple(len(v) for v in values)
+    n_cells = int(np.prod(shape, dtype=np.int64))
+    X = np.empty((n_cells, base_row.shape[0]), dtype=np.float32)
+    X[:] = base_row
+    if values:
+        for name, grid in zip(axes, np.meshgrid(*values, indexing="ij")):
+            X[:, column_index[SWEEP_AXES[name]]] = grid.ravel()
+    return X, shape
+
+
+def sweep(model, base_row, column_index, axes):
+    """Score the full grid of `axes` around `base_row`; returns an array of shape (len(v) for v in axes)."""
+    X, shape = build_grid(base_row, column_index, axes)
+    return score_rows(model, X).reshape(shape)
+
+
+def audience_insights(model, base_row, column_index):
+    """Age and income one-at-a-time what-ifs, scored in a single model call."""
+    return audience_insights_batch(model, base_row[None, :], column_index)[0]
+
+
+def audience_insights_batch(model, base_rows, column_index):
+    """audience_insights for every row of `base_rows`, all what-if rows scored in one model call."""
+    n_age = len(AGE_BUCKETS)
+    n_what_if = n_age + len(INCOME_BUCKETS)
+    n_rows, n_features = base_rows.shape
+    X = np.empty((n_rows, n_what_if, n_features), dtype=np.float32)
+    X[:] = base_rows[:, None, :]
+    X[:, :n_age, column_index["Age"]] = [value for value, _ in AGE_BUCKETS]
+    X[:, n_age:, column_index["Area Income"]] = [value for value, _ in INCOME_BUCKETS]
+    scores = score_rows(model, X.reshape(n_rows * n_what_if, n_features)).reshape(n_rows, n_what_if)
+    return [
+        {
+            "age_performance": [{"label": lbl, "score": round(float(score) * 100, 2)} for (_, lbl), score in zip(AGE_BUCKETS, row[:n_age])],
+            "income_performance": [{"label": lbl, "score": round(float(score) * 100, 2)} for (_, lbl), score in zip(INCOME_BUCKETS, row[n_age:])]
+        }
+        for row in scores
+    ]
@@ -0,0 +1,39 @@
+# tests/conftest.py
+import hashlib
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# No persistent embedding store: tests neither read nor write .cache/embeddings
+os.environ["EMBEDDING_CACHE_DIR"] = ""
+
+from feature_engineering import EMBEDDING_DIM  # noqa: E402
+from resources import resources  # noqa: E402
+
+
+class StubEncoder:
+    """Deterministic stand-in for the sentence-transformer: a unit vector seeded by each text's hash."""
+
+    def encode(self, texts):
+        rows = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+            vector = np.random.default_rng(seed).normal(size=EMBEDDING_DIM).astype(np.float32)
+            rows.append(vector / np.linalg.norm(vector))
+        return np.stack(rows)
+
+
+@pytest.fixture(autouse=True, scope="session")
+def stub_encoder():
+    resources.register("embedding_model", StubEncoder)
+    yield
+
+
+@pytest.fixture(scope="session")
+def ads():
+    import pandas as pd
+    return pd.read_csv(os.path.join(ROOT, "data", "advertising.csv")).sample(200, random_state=0)
@@ -0,0 +1,67 @@
+# tests/test_ann_index.py
+import numpy as np
+import pytest
+
+from ann_index import IVFIndex, ad_key, build_index
+
+DIM = 16
+
+
+def nul_terminated_text():
+    # An ad whose 16-byte key ends in a NUL byte, which S16 tolist() used to strip
+    i = 0
+    while not ad_key(f"ad {i}").endswith(b"\x00"):
+        i += 1
+    return f"ad {i}"
+
+
+@pytest.fixture
+def index(tmp_path):
+    rng = np.random.default_rng(0)
+    texts = [nul_terminated_text()] + [f"past ad {i}" for i in range(199)]
+    build_index(str(tmp_path), texts, rng.normal(size=(len(texts), DIM)), np.ones(len(texts)), np.full(len(texts), 10))
+    return IVFIndex(str(tmp_path), nprobe=4)
+
+
+def indexed_counts(index, text):
+    # Searched with the ad's own indexed vector, so its list is always probed
+    vector = index.vectors[index._main_row(ad_key(text))]
+    for entry in index.search(vector, k=len(index))[0]:
+        if entry["ad_text"] == text:
+            return entry["clicks"], entry["impressions"]
+    return None
+
+
+def test_indexed_ad_with_nul_key_is_not_reinserted(index):
+    text = nul_terminated_text()
+    size = len(index)
+    index.insert([text], np.random.default_rng(1).normal(size=(1, DIM)), [2], [5])
+    assert len(index) == size
+    assert indexed_counts(index, text) == (3, 15)
+
+
+@pytest.mark.parametrize("retrain", [False, True])
+def test_compact_keeps_inserted_ads_and_counts(index, tmp_path, retrain):
+    rng = np.random.default_rng(2)
+    vectors = rng.normal(size=(3, DIM))
+    index.insert(["new ad", "new ad", "past ad 7"], vectors, [1, 1, 1], [4, 4, 4])
+    size = len(index)
+    index.compact(retrain=retrain)
+
+    reopened = IVFIndex(str(tmp_path), nprobe=4)
+    assert len(reopened) == size and not reopened.delta_texts
+    assert indexed_counts(reopened, "new ad") == (2, 8)
+    assert indexed_counts(reopened, "past ad 7") == (2, 14)
+    assert indexed_counts(reopened, nul_terminated_text()) == (1, 10)
+    index.insert(["new ad"], vectors[:1], [0], [1])
+    assert len(index) == size
+
+
+def test_delta_is_compacted_in_the_background(tmp_path):
+    rng = np.random.default_rng(3)
+    build_index(str(tmp_path), [f"past ad {i}" for i in range(100)], rng.normal(size=(100, DIM)),
+                np.zeros(100), np.ones(100))
+    index = IVFIndex(str(tmp_path), max_delta_rows=20)
+    index.insert([f"new ad {i}" for i in range(25)], rng.normal(size=(25, DIM)), [0] * 25, [1] * 25)
+    index._compactor.join()
+    assert len(index) == 125 and not index.delta_texts
@@ -0,0 +1,84 @@
+# tests/test_model_registry.py
+import json
+import os
+
+import numpy as np
+import pytest
+import xgboost as xgb
+
+from feature_engineering import TABULAR_FEATURES
+from model_registry import ModelRegistry
+
+COLUMNS = TABULAR_FEATURES + [f"emb_{i}" for i in range(4)]
+
+
+def save_model(path, seed):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(200, len(COLUMNS))).astype(np.float32)
+    dtrain = xgb.DMatrix(X, label=(X[:, seed % len(COLUMNS)] > 0).astype(np.float32), feature_names=COLUMNS)
+    xgb.train({"objective": "binary:logistic", "max_depth": 2, "seed": seed}, dtrain, num_boost_round=5).save_model(str(path))
+
+
+@pytest.fixture
+def registry(tmp_path):
+    columns = tmp_path / "model_columns.json"
+    columns.write_text(json.dumps(COLUMNS))
+    registry = ModelRegistry()
+    for seed, name in enumerate(["v1", "v2"]):
+        save_model(tmp_path / f"{name}.json", seed)
+        registry.register(name, str(tmp_path / f"{name}.json"), str(columns))
+    return registry
+
+
+def test_single_weight_routes_to_that_version(registry):
+    assert registry.active.name == "v1"
+    registry.set_routing({"v2": 1})
+    assert {registry.route().name for _ in range(50)} == {"v2"}
+    # A zero weight is dropped, leaving v2 alone
+    registry.set_routing({"v1": 0, "v2": 1})
+    assert {registry.route(key=i).name for _ in range(50) for i in range(5)} == {"v2"}
+
+
+def test_weighted_routing_is_sticky_per_key(registry):
+    registry.set_routing({"v1": 1, "v2": 1})
+    assert {registry.route().name for _ in range(200)} == {"v1", "v2"}
+    assert all(registry.route(key=k).name == registry.route(key=k).name for k in range(50))
+    with pytest.raises(KeyError):
+        registry.set_routing({"v3": 1})
+    with pytest.raises(ValueError):
+        registry.set_routing({"v1": 0})
+
+
+def test_activate_resets_routing(registry):
+    registry.set_routing({"v1": 1, "v2": 3})
+    registry.activate("v2")
+    assert registry.describe()["routing"] == {"v2": 1.0}
+    assert {registry.route().name for _ in range(20)} == {"v2"}
+
+
+def test_changed_model_file_is_hot_swapped(registry):
+    before = registry.get("v1")
+    assert registry.reload_changed() == []
+    save_model(before.model_path, seed=7)
+    mtime = os.stat(before.model_path).st_mtime_ns
+    os.utime(before.model_path, ns=(mtime, mtime + 10 ** 9))  # a distinct mtime however coarse the clock
+    assert registry.reload_changed() == ["v1"]
+    assert registry.get("v1") is not before
+
+
+def test_model_directory_follows_the_file_it_serves(tmp_path):
+    # As after streaming training (native export added) and an in-memory retrain (export removed)
+    (tmp_path / "model_columns.json").write_text(json.dumps(COLUMNS))
+    save_model(tmp_path / "model.json", seed=0)
+    registry = ModelRegistry()
+    registry.register("v1", str(tmp_path), str(tmp_path / "model_columns.json"))
+    assert registry.active.model_file == str(tmp_path / "model.json")
+
+    save_model(tmp_path / "model.ubj", seed=1)
+    assert registry.reload_changed() == ["v1"]
+    assert registry.active.model_file == str(tmp_path / "model.ubj")
+
+    os.remove(tmp_path / "model.ubj")
+    assert registry.reload_changed() == ["v1"]
+    assert registry.active.model_file == str(tmp_path / "model.json")
+    assert registry.reload_changed() == [] and not registry.describe()["errors"]
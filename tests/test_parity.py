@@ -0,0 +1,59 @@
+# tests/test_parity.py
+# The fast serving paths must match the reference implementations they replace.
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+
+from dim_reduction import fit_reducer
+from explain import make_explainer
+from feature_engineering import TABULAR_FEATURES, create_features, embed_texts
+from feature_plan import FeaturePlan
+
+
+def api_inputs(df):
+    inputs = pd.DataFrame({
+        'Ad Topic Line': df['Ad Topic Line'].values,
+        'Age': df['Age'].values,
+        'Area Income': df['Area Income'].values,
+        'Male': df['Male'].values,
+        'Hour': pd.to_datetime(df['Timestamp']).dt.hour.values,
+        'DayOfWeek': pd.to_datetime(df['Timestamp']).dt.dayofweek.values,
+    })
+    inputs.loc[0, 'Area Income'] = np.nan  # exercise the missing-value fill
+    return inputs
+
+
+@pytest.fixture(scope="module")
+def model(ads):
+    X, y = create_features(ads.copy(), is_training=True)
+    clf = xgb.XGBClassifier(n_estimators=20, max_depth=3, learning_rate=0.3, random_state=0)
+    clf.fit(X, y)
+    return clf.get_booster(), list(X.columns)
+
+
+@pytest.mark.parametrize("reduction", [None, "pca"])
+def test_feature_plan_matches_create_features(ads, reduction):
+    inputs = api_inputs(ads.head(50))
+    reducer = fit_reducer(reduction, embed_texts(ads['Ad Topic Line'].tolist()), 16) if reduction else None
+    n_embedding = reducer.output_dim if reducer is not None else embed_texts(["probe"]).shape[1]
+    model_columns = TABULAR_FEATURES + [f"emb_{i}" for i in range(n_embedding)]
+
+    pandas_rows = create_features(inputs.copy(), is_training=False, reducer=reducer)[model_columns].to_numpy(dtype=np.float32)
+    embeddings = embed_texts(inputs['Ad Topic Line'].tolist())
+    if reducer is not None:
+        embeddings = reducer.transform(embeddings)
+    plan_rows = FeaturePlan(model_columns).assemble(inputs.drop(columns=['Ad Topic Line']).to_dict('records'), embeddings)
+
+    assert plan_rows.dtype == pandas_rows.dtype and plan_rows.shape == pandas_rows.shape
+    assert plan_rows.tobytes() == pandas_rows.tobytes()
+
+
+def test_native_explainer_matches_shap(ads, model):
+    pytest.importorskip("shap")
+    booster, model_columns = model
+    X = create_features(ads.head(50).copy(), is_training=False)[model_columns].to_numpy(dtype=np.float32)
+    reference = make_explainer(booster, model_columns, backend="shap")
+    native = make_explainer(booster, model_columns, backend="native")
+    assert np.abs(native.contributions(X) - reference.contributions(X)).max() < 1e-3
+    assert np.abs(native.group_contributions(X) - reference.group_contributions(X)).max() < 1e-3
@@ -1,49 +1,161 @@
 # train_model.py
+import argparse
 import pandas as pd
+import numpy as np
 import xgboost as xgb
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, classification_report
+from sklearn.metrics import accuracy_score, classification_report, roc_auc_score
 import joblib
 import json
-from feature_engineering import create_features
+import os
+import time
+from dim_reduction import REDUCTION_KINDS, fit_reducer, reducer_path
+from explain import NativeExplainer
+from feature_engineering import create_features, embedding_cache
+from feature_store import FeatureStore
+from streaming_train import inject_demo_labels, train_streaming
+
+parser = argparse.ArgumentParser(description="Train the click-prediction model")
+parser.add_argument("--reduction", choices=("none",) + REDUCTION_KINDS,
+                    default=os.environ.get("EMBEDDING_REDUCTION", "none"),
+                    help="project the 384-d embeddings down before training (saved for serving)")
+parser.add_argument("--dim", type=int, default=int(os.environ.get("EMBEDDING_REDUCED_DIM", "64")),
+                    help="embedding dimensions kept with --reduction")
+parser.add_argument("--report-dims", type=int, nargs="*", default=[],
+                    help="also train at these embedding sizes and compare them, e.g. 384 128 64 32")
+parser.add_argument("--feature-dtype", choices=["float32", "float16"],
+                    help="storage precision of the feature store (default FEATURE_STORE_DTYPE or float32)")
+parser.add_argument("--streaming", action="store_true",
+                    help="out-of-core training: stream the CSVs in chunks into XGBoost external memory")
+parser.add_argument("--data", nargs="+", default=["data/advertising.csv"], help="training CSV file(s)")
+parser.add_argument("--chunk-size", type=int, default=int(os.environ.get("TRAIN_CHUNK_ROWS", "50000")),
+                    help="rows per chunk with --streaming (bounds peak memory)")
+parser.add_argument("--test-fraction", type=float, default=0.2,
+                    help="share of rows held out (by row hash) with --streaming")
+args = parser.parse_args()
+
+# Streaming mode: memory is bounded by one chunk instead of the whole dataset.
+# It neither uses the feature store nor trains the comparison models.
+if args.streaming:
+    if args.report_dims:
+        parser.error("--report-dims is not supported with --streaming")
+    if args.feature_dtype:
+        parser.error("--feature-dtype is not supported with --streaming (it does not use the feature store)")
+    train_streaming(args.data, args.chunk_size, args.test_fraction, args.reduction, args.dim,
+                    cache_dir=os.environ.get("XGB_EXTERNAL_CACHE_DIR", ".cache/xgb_external"))
+    raise SystemExit(0)
+args.feature_dtype = args.feature_dtype or os.environ.get("FEATURE_STORE_DTYPE", "float32")
 
 # 1. Load Data
 print("Loading data...")
-df_raw = pd.read_csv('data/advertising.csv')
+df_raw = pd.concat([pd.read_csv(path) for path in args.data], ignore_index=True)
 
-# Inject artificial temporal correlations for demonstration purposes
-# so that the model actually learns to use Hour and DayOfWeek
 df_raw['Timestamp'] = pd.to_datetime(df_raw['Timestamp'])
-# Late night ads (midnight to 6am) perform poorly
-df_raw.loc[(df_raw['Timestamp'].dt.hour < 6), 'Clicked on Ad'] = 0
-# Weekend ads perform exceptionally well
-df_raw.loc[(df_raw['Timestamp'].dt.dayofweek >= 5), 'Clicked on Ad'] = 1
+# Same demonstration labels as streaming training, so that the model learns Hour and DayOfWeek
+df_raw = inject_demo_labels(df_raw)
 
 # 2. Create Features (This includes NLP embeddings)
+# Rows already in the feature store (FEATURE_STORE_DIR; empty string disables it)
+# are memory-mapped from disk; only new or changed rows are embedded.
 print("Creating features...")
-X, y = create_features(df_raw.copy(), is_training=True)
+feature_store_dir = os.environ.get("FEATURE_STORE_DIR", ".cache/feature_store")
+if feature_store_dir:
+    X, feature_columns, report = FeatureStore(feature_store_dir, args.feature_dtype).materialize(df_raw)
+    y = df_raw['Clicked on Ad'].values
+    print(f"Feature store: {report['rows']} rows, reused {report['reused']}, "
+          f"recomputed {report['recomputed']} ({report['seconds']}s)")
+else:
+    X, y = create_features(df_raw.copy(), is_training=True)
+    feature_columns = X.columns.tolist()
+print(f"Embedding cache: {embedding_cache.stats()}")
+X = np.asarray(X, dtype=np.float32)
+emb_positions = [i for i, col in enumerate(feature_columns) if col.startswith('emb_')]
+tab_positions = [i for i, col in enumerate(feature_columns) if not col.startswith('emb_')]
 
-# Save the column order! This is crucial for prediction.
-model_columns = X.columns.tolist()
-with open('saved_model/model_columns.json', 'w') as f:
-    json.dump(model_columns, f)
+# 3. Train Test Split (on row indices, so every embedding size sees the same split)
+train_idx, test_idx = train_test_split(np.arange(len(y)), test_size=0.2, random_state=42)
+y_train, y_test = y[train_idx], y[test_idx]
+
+
+def reduce_features(reducer):
+    """Model matrix and columns with the embedding block projected by `reducer` (None keeps it)."""
+    if reducer is None:
+        return X, feature_columns
+    reduced = np.hstack([X[:, tab_positions], reducer.transform(X[:, emb_positions])])
+    columns = [feature_columns[i] for i in tab_positions] + [f"emb_{i}" for i in range(reducer.output_dim)]
+    return reduced, columns
+
+
+def make_reducer(kind, dim):
+    # Fitted on the training rows only; random projection ignores the data
+    if kind == "none" or dim >= len(emb_positions):
+        return None
+    return fit_reducer(kind, X[train_idx][:, emb_positions], dim)
 
-# 3. Train Test Split
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+def train(X_model, model_columns):
+    xgbc = xgb.XGBClassifier(
+        objective='binary:logistic',
+        n_estimators=100,
+        learning_rate=0.1,
+        random_state=42,
+        eval_metric='logloss'
+    )
+    xgbc.fit(X_model[train_idx], y_train)
+    # Keep column names on the booster even when trained from the memory-mapped matrix
+    xgbc.get_booster().feature_names = model_columns
+    return xgbc
+
+
+def median_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return round(float(np.median(samples)) * 1000, 4)
+
+
+# Optional: accuracy vs cost at several embedding sizes, to pick --dim deliberately
+if args.report_dims:
+    kind = args.reduction if args.reduction != "none" else "pca"
+    print(f"Comparing embedding sizes {args.report_dims} ({kind})...")
+    rows = []
+    for dim in args.report_dims:
+        reducer = make_reducer(kind, dim)
+        X_model, model_columns = reduce_features(reducer)
+        xgbc = train(X_model, model_columns)
+        booster = xgbc.get_booster()
+        X_test = X_model[test_idx]
+        probs = xgbc.predict_proba(X_test)[:, 1]
+        row = np.ascontiguousarray(X_test[:1])
+        explainer = NativeExplainer(booster, model_columns)
+        rows.append({
+            "embedding_dim": reducer.output_dim if reducer else len(emb_positions),
+            "reduction": reducer.kind if reducer else "none",
+            "accuracy": round(float(accuracy_score(y_test, probs > 0.5)), 4),
+            "auc": round(float(roc_auc_score(y_test, probs)), 4),
+            "model_bytes": len(booster.save_raw("ubj")),
+            "row_bytes": X_model.shape[1] * 4,
+            "predict_ms": median_ms(lambda: booster.inplace_predict(row), 200),
+            "shap_ms": median_ms(lambda: explainer.contributions(row), 50),
+        })
+    print(f"{'dim':>5} {'reduction':>9} {'accuracy':>9} {'AUC':>7} {'model KB':>9} {'row B':>6} {'predict ms':>11} {'SHAP ms':>8}")
+    for r in rows:
+        print(f"{r['embedding_dim']:>5} {r['reduction']:>9} {r['accuracy']:>9.4f} {r['auc']:>7.4f} "
+              f"{r['model_bytes'] / 1024:>9.1f} {r['row_bytes']:>6} {r['predict_ms']:>11.4f} {r['shap_ms']:>8.4f}")
+    with open('saved_model/reduction_report.json', 'w') as f:
+        json.dump(rows, f, indent=2)
+    print("Report saved to saved_model/reduction_report.json")
 
 # 4. Train Model
-print("Training XGBClassifier...")
-xgbc = xgb.XGBClassifier(
-    objective='binary:logistic', 
-    n_estimators=100, 
-    learning_rate=0.1, 
-    random_state=42,
-    eval_metric='logloss'
-)
-xgbc.fit(X_train, y_train)
+reducer = make_reducer(args.reduction, args.dim)
+X_model, model_columns = reduce_features(reducer)
+print(f"Training XGBClassifier on {len(model_columns)} features...")
+xgbc = train(X_model, model_columns)
 
 # 5. Evaluate Model
-y_pred = xgbc.predict(X_test)
+y_pred = xgbc.predict(X_model[test_idx])
 accuracy = accuracy_score(y_test, y_pred)
 
 print(f"Model Evaluation on Test Set:")
@@ -52,6 +164,18 @@ print("Classification Report:")
 print(classification_report(y_test, y_pred))
 
 # 6. Save the trained model
+# Save the column order! This is crucial for prediction.
+with open('saved_model/model_columns.json', 'w') as f:
+    json.dump(model_columns, f)
+# The reducer lives next to the columns; serving applies it before assembling rows
+if reducer is not None:
+    reducer.save(reducer_path('saved_model/model_columns.json'))
+elif os.path.exists(reducer_path('saved_model/model_columns.json')):
+    os.remove(reducer_path('saved_model/model_columns.json'))
 joblib.dump(xgbc, 'saved_model/model.joblib')
+# Native exports (e.g. from --streaming) are served in preference to model.joblib; drop the stale ones
+for stale in ('saved_model/model.ubj', 'saved_model/model.json'):
+    if os.path.exists(stale):
+        os.remove(stale)
 
-print("\nModel and columns saved successfully in 'saved_model/' directory.")
\ No newline at end of file
+print("\nModel and columns saved successfully in 'saved_model/' directory.")